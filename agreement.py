@@ -1,95 +1,220 @@
 # Imports
 import csv
+import hashlib
+import os
+from array import array
 
-import sklearn.metrics
-from sklearn.metrics import cohen_kappa_score
 import numpy as np
-from collections import Counter
+
+# Likert scale questions in the survey
+questions = ['button-discover','button-distinct','shortcut-discover','shortcut-intuitive',
+             'text-discover', 'text-comprehend', 'safety-discover']
+# Answers to each likert scale, in order (coded as their index)
+likert_options = ['Strongly disagree', 'Somewhat disagree', 'Neither agree nor disagree', 'Somewhat agree',
+                  'Strongly agree']
+# Code of each answer when strongly/somewhat answers are combined into disagree/neither/agree
+# The extra -1 at the end maps missing answers (coded -1) to themselves
+squashed_codes = np.array([0, 0, 1, 2, 2, -1])
+
+# Survey export downloaded from qualtrics
+survey_filename = 'exit_button_annotations.csv'
+# Bytes hashed from the start of the file and from just before the end of what has been read, to tell whether the file
+# was replaced (e.g. by a fresh export) since it was last read
+check_size = 4096
+
+class SurveyTable:
+    # Survey responses stored by column: rater and (site, platform) as codes into the raters and sites lists, and the
+    # answer to each question as its index in likert_options (-1 if not answered), in answers[row * len(questions) + q]
+    # Only the columns needed for analysis are kept
+    def __init__(self, filename=survey_filename):
+        self.filename = filename
+        self._clear()
+
+    def _clear(self):
+        self.raters = []
+        self.sites = []
+        self.rater_codes = array('H')
+        self.site_codes = array('H')
+        self.answers = array('b')
+        self._rater_index = {}
+        self._site_index = {}
+        # Byte offset of the end of the last complete row read, and the header's column index of each kept column
+        self.offset = 0
+        self.columns = None
+        # Size of the file and hash of the start and end of what was read, when it was last read
+        self.size = 0
+        self.prefix_hash = None
+
+    def __len__(self):
+        return len(self.rater_codes)
+
+    def _code(self, values, index, value):
+        if value not in index:
+            index[value] = len(values)
+            values.append(value)
+        return index[value]
+
+    def _lines(self, f):
+        # Yield complete lines only, so a row still being written is left for the next reload
+        while True:
+            line = f.readline()
+            if not line.endswith(b'\n'):
+                return
+            yield line.decode('utf-8-sig')
+
+    def _prefix_hash(self, f):
+        f.seek(0)
+        start = f.read(min(check_size, self.offset))
+        f.seek(max(self.offset - check_size, 0))
+        end = f.read(self.offset - f.tell())
+        return hashlib.sha256(start + end).hexdigest()
+
+    def reload(self):
+        # Read any rows appended to the file since it was last read, returning the number of new rows
+        # If the file has shrunk or what was read has changed (it was replaced or truncated), it is read again in full
+        # and every row counts as new
+        option_index = {option: o for o, option in enumerate(likert_options)}
+        with open(self.filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if self.offset > 0 and (size < self.size or self._prefix_hash(f) != self.prefix_hash):
+                self._clear()
+            n_rows = len(self)
+            f.seek(self.offset)
+            lines = self._lines(f)
+            reader = csv.reader(lines)
+            if self.columns is None:
+                # Resolve the kept columns from the header once
+                header = next(reader)
+                self.columns = [header.index(column) for column in ['eval-name', 'eval-site', 'eval-platform']] + \
+                               [header.index(question) for question in questions]
+                self.offset = f.tell()
+                # Qualtrics exports may have a row of question labels and a row of ImportIds after the header
+                for _ in range(2):
+                    row = next(reader, None)
+                    if row is None or not (row[0] == 'Start Date' or row[0].startswith('{')):
+                        # Not a label row; re-read it as data below
+                        f.seek(self.offset)
+                        break
+                    self.offset = f.tell()
+                reader = csv.reader(self._lines(f))
+            width = max(self.columns) + 1
+            for row in reader:
+                if len(row) < width:
+                    # Incomplete row
+                    break
+                name, site, platform = row[self.columns[0]], row[self.columns[1]], row[self.columns[2]]
+                self.rater_codes.append(self._code(self.raters, self._rater_index, name))
+                self.site_codes.append(self._code(self.sites, self._site_index, (site, platform)))
+                self.answers.extend(option_index.get(row[c], -1) for c in self.columns[3:])
+                self.offset = f.tell()
+            self.size = size
+            self.prefix_hash = self._prefix_hash(f)
+        return len(self) - n_rows
+
+    def rows(self):
+        # Iterate over rows as compact (rater, (site, platform), answers) tuples
+        n_questions = len(questions)
+        for i in range(len(self)):
+            yield self.raters[self.rater_codes[i]], self.sites[self.site_codes[i]], \
+                  tuple(self.answers[i * n_questions:(i + 1) * n_questions])
+
+    def matrix(self):
+        # Code all responses into a matrix indexed [site, rater, question], with -1 for missing answers
+        # If a rater answered the same site more than once, their latest answer to each question is used
+        answers = np.frombuffer(self.answers, dtype=np.int8).reshape(len(self), len(questions))
+        site_codes = np.frombuffer(self.site_codes, dtype=np.uint16)
+        rater_codes = np.frombuffer(self.rater_codes, dtype=np.uint16)
+        # Raters in name order, to match response_matrix
+        order = sorted(range(len(self.raters)), key=lambda r: self.raters[r])
+        rater_rank = np.argsort(order)
+        matrix = np.full((len(self.sites), len(self.raters), len(questions)), -1, dtype=np.int8)
+        for q in range(len(questions)):
+            answered = answers[:, q] >= 0
+            # Assigned in row order, so later answers overwrite earlier ones
+            matrix[site_codes[answered], rater_rank[rater_codes[answered]], q] = answers[answered, q]
+        return list(self.sites), [self.raters[r] for r in order], matrix
+
+# Survey tables by filename, kept so that reloading only reads new rows
+survey_tables = {}
+
+def load_survey_table(filename=survey_filename):
+    # Load survey responses as a SurveyTable, reading only rows added since the file was last loaded
+    if filename not in survey_tables:
+        survey_tables[filename] = SurveyTable(filename)
+    survey_tables[filename].reload()
+    return survey_tables[filename]
 
 def load_survey_data():
-    # Load survey responses from file into a dictionary
+    # Load survey responses from file into a dictionary by (site, platform) of each rater's answers
     responses = {}
-    with open('exit_button_annotations.csv', 'r') as annotations_file:
-        reader = csv.DictReader(annotations_file)
-        for row in reader:
-            if row['StartDate'] == 'Start Date' or row['StartDate'][0] == '{':
-                # Skip the labels row
-                continue
-            # Extract key fields
-            site = row['eval-site']
-            platform = row['eval-platform']
-            # Delete unnecessary [qualtrics] fields
-            del row['StartDate'], row['EndDate'], row['Status'], row['Progress'], \
-                row['Duration (in seconds)'], row['Finished'], row['RecordedDate'], \
-                row['ResponseId'], row['DistributionChannel'], row['UserLanguage'], \
-                row['eval-site'], row['eval-platform'], row['button-comments'], \
-                row['shortcut-comments'], row['text-comments'], row['safety-comments']
-            if (site,platform) in responses:
-                responses[(site,platform)].append(row)
-            else:
-                responses[site,platform] = [row]
+    for name, site, answers in load_survey_table().rows():
+        row = {'eval-name': name}
+        for question, answer in zip(questions, answers):
+            row[question] = likert_options[answer] if answer >= 0 else ''
+        if site in responses:
+            responses[site].append(row)
+        else:
+            responses[site] = [row]
     return responses
 
+def response_matrix(responses):
+    # Code all responses into a matrix indexed [site, rater, question], with -1 for missing answers
+    # If a rater answered the same site more than once, their latest answer to each question is used
+    sites = list(responses)
+    raters = sorted({response['eval-name'] for site in sites for response in responses[site]})
+    rater_index = {rater: r for r, rater in enumerate(raters)}
+    option_index = {option: o for o, option in enumerate(likert_options)}
+    matrix = np.full((len(sites), len(raters), len(questions)), -1, dtype=np.int8)
+    for s, site in enumerate(sites):
+        for response in responses[site]:
+            r = rater_index[response['eval-name']]
+            for q, question in enumerate(questions):
+                if response.get(question, '') in option_index:
+                    matrix[s, r, q] = option_index[response[question]]
+    return sites, raters, matrix
+
+def matrix_agreements(raters, matrix, squash_agree=False, pair=('Alice', 'Kieron Ivy')):
+    # Compute Fleiss' and Cohen's Kappa for every question at once, from the coded response matrix
+    # Only sites where both raters in pair answered a question are counted for that question
+    codes = matrix[:, [raters.index(rater) for rater in pair], :]
+    if squash_agree:
+        codes = squashed_codes[codes]
+    n_categories = 3 if squash_agree else len(likert_options)
+    n_annotators = len(pair)
+    answered = (codes >= 0).all(axis=1)
+    n_sites = answered.sum(axis=0)
+
+    # Fleiss' Kappa: count the answers for each site and question: shape (site, question, category)
+    counts = (codes[..., None] == np.arange(n_categories)).sum(axis=1) * answered[..., None]
+    p = counts.sum(axis=0) / (n_sites * n_annotators)[:, None]
+    pp = ((counts * counts).sum(axis=-1) - n_annotators) / (n_annotators * (n_annotators - 1))
+    pbar = (pp * answered).sum(axis=0) / n_sites
+    pbar_e = (p * p).sum(axis=-1)
+    fleiss_kappa = (pbar - pbar_e) / (1 - pbar_e)
+
+    # Cohen's Kappa: confusion matrix of the pair's answers for each question: shape (question, category, category)
+    first, second = codes[:, 0, :], codes[:, 1, :]
+    question_offset = np.arange(len(questions)) * n_categories * n_categories
+    index = (question_offset + first * n_categories + second)[answered]
+    confusion = np.bincount(index, minlength=len(questions) * n_categories * n_categories)
+    confusion = confusion.reshape(len(questions), n_categories, n_categories) / n_sites[:, None, None]
+    p_observed = np.trace(confusion, axis1=1, axis2=2)
+    p_expected = (confusion.sum(axis=2) * confusion.sum(axis=1)).sum(axis=1)
+    cohen_kappa = (p_observed - p_expected) / (1 - p_expected)
+
+    return {question: {'Fleiss': float(fleiss_kappa[q]), 'Cohen': float(cohen_kappa[q])}
+            for q, question in enumerate(questions)}
+
 def agreements(responses, squash_agree=False):
-    # For each survey likert scale, compute Fleiss' Kappa
-    questions = ['button-discover','button-distinct','shortcut-discover','shortcut-intuitive',
-                'text-discover', 'text-comprehend', 'safety-discover']
-
-    # Matrix of responses per question where rows are evaluators and columns are site/platform pairs
-    kappas = {q: {'Fleiss': 0, 'Cohen': 0} for q in questions}
-    for question in questions:
-        person_responses = {'Yanna':[], 'Alice':[], 'Kieron Ivy':[]}
-        confusion_mat = []
-        for site in responses:
-            # FLEISS KAPPA IMPLEMENTATION
-            if (any(1 for response in responses[site] if response['eval-name'] == 'Alice' and response[question] != '') and
-                any(1 for response in responses[site] if response['eval-name'] == 'Kieron Ivy' and response[question] != '')):
-                # FLEISS KAPPA IMPLEMENTATION
-                filtered_responses = [d[question] for d in filter(
-                    lambda r: question in r and r[question] != '' and r['eval-name'] != 'Yanna', responses[site])]
-                counts = Counter(filtered_responses)
-                if len(filtered_responses) > 2:
-                    print(f"duplicates for {site=}")
-                options = ['Strongly disagree', 'Somewhat disagree', 'Neither agree nor disagree', 'Somewhat agree',
-                           'Strongly agree']
-                if squash_agree:
-                    # Sum the strongly/somewhat answers
-                    confusion_mat.append([
-                        (counts['Strongly disagree'] if 'Strongly disagree' in counts else 0) +
-                        (counts['Somewhat disagree'] if 'Somewhat disagree' in counts else 0),
-                        (counts['Neither agree nor disagree'] if 'Neither agree nor disagree' in counts else 0),
-                        (counts['Somewhat agree'] if 'Somewhat agree' in counts else 0) +
-                        (counts['Strongly agree'] if 'Strongly agree' in counts else 0)
-                    ])
-                else:
-                    confusion_mat.append([counts[option] if option in counts else 0 for option in options])
-
-                # COHENS KAPPA IMPLEMENTATION
-                for response in responses[site]:
-                    if squash_agree:
-                        # Combine strongly/somewhat answers into agree/disagree
-                        response[question] = response[question].replace("Somewhat ","").replace("Strongly ","")
-                    person_responses[response['eval-name']].append(response[question])
-        # Fleiss' Kappa
-        confusion_mat = np.array(confusion_mat)
-        #print(question, '\n', confusion_mat)
-        n_sites, _ = confusion_mat.shape
-        n_annotators = 2
-
-        p = np.sum(confusion_mat, axis=0) / (n_sites * n_annotators)
-        pp = (np.sum(confusion_mat * confusion_mat, axis=1) - n_annotators) / (n_annotators * (n_annotators - 1))
-        pbar = np.sum(pp) / n_sites
-        pbar_e = np.sum(p * p)
-        fleiss_kappa = (pbar - pbar_e) / (1 - pbar_e)
-        cohen_kappa = sklearn.metrics.cohen_kappa_score(person_responses['Alice'], person_responses['Kieron Ivy'])
-
-        kappas[question]['Fleiss'] = fleiss_kappa
-        kappas[question]['Cohen'] = cohen_kappa
-    return kappas
+    # For each survey likert scale, compute Fleiss' and Cohen's Kappa (the responses are not modified)
+    _, raters, matrix = response_matrix(responses)
+    return matrix_agreements(raters, matrix, squash_agree)
 
 
 if __name__ == "__main__":
-    responses = load_survey_data()
-    kappas = agreements(responses, True)
-    print(str(kappas).replace("},", "},\n"))
-
+    # Code the responses once, then compute agreement with and without combining strongly/somewhat answers
+    _, raters, matrix = load_survey_table().matrix()
+    for squash_agree in [False, True]:
+        kappas = matrix_agreements(raters, matrix, squash_agree)
+        print("Squashed:" if squash_agree else "Unsquashed:")
+        print(str(kappas).replace("},", "},\n"))
@@ -0,0 +1,135 @@
+# Site annotation store
+#
+# Keeps a CSV file of site annotations (site_info.csv, or site_info_auto.csv for automatic annotations) open for
+# appending, with an index of the latest row for each (URL, Platform) so checking whether a site is done doesn't need to
+# read the file. Each row is appended with a single write while holding a lock on the file, so rows from several
+# annotators (or the crawler) sharing a file never interleave, and a crash can at worst leave one truncated row, which
+# is ignored. If a site is saved more than once, the file is compacted to keep only its latest row, so scripts reading
+# the CSV directly never see a site twice
+#
+# Unix only (the file is locked with flock)
+import csv
+import fcntl
+import io
+import os
+import threading
+
+from evaluate import append_line
+
+# Columns of site_info.csv
+site_info_columns = ['URL', 'Platform', 'Colour', 'Background Colour', 'Size', 'Location', 'Type', 'Sticky?',
+                     'Visible on load?', 'Label', 'Clicks Required', 'Goes To URL']
+
+
+class AnnotationStore:
+    def __init__(self, filename, columns=site_info_columns):
+        self.filename = filename
+        self.columns = columns
+        # Latest row for each (URL, Platform), in the order sites were last saved
+        self.index = {}
+        # How much of the file has been read into the index, and how many rows that was (more than the number of sites
+        # if any site has been saved more than once, or a row was truncated by a crash)
+        self.offset = 0
+        self.n_rows = 0
+        self.fd = os.open(filename, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        # Rows may be saved from several threads (e.g. auto_annotate.py's browsers); flock only excludes other processes
+        self.thread_lock = threading.Lock()
+        self.lock()
+        try:
+            if os.fstat(self.fd).st_size == 0:
+                append_line(self.fd, self.format_row(columns))
+            self.read_new_rows()
+            if self.n_rows > len(self.index):
+                self.compact()
+        finally:
+            self.unlock()
+
+    # Lock the file, first reopening it (and reading it afresh) if another store has compacted it
+    def lock(self):
+        while True:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            # Compaction replaces the file, which is always present as the replace is atomic
+            if os.fstat(self.fd).st_ino == os.stat(self.filename).st_ino:
+                return
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = os.open(self.filename, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            self.index, self.offset, self.n_rows = {}, 0, 0
+
+    def unlock(self):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    # Rewrite the file with only the latest complete row of each site (called with the lock held)
+    # The new file is written and locked before replacing the old one, so other stores wait for it and then reopen it
+    def compact(self):
+        data = self.format_row(self.columns) + b"".join(self.format_row(row.values()) for row in self.index.values())
+        fd = os.open(self.filename + ".tmp", os.O_RDWR | os.O_APPEND | os.O_CREAT | os.O_TRUNC, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.write(fd, data)
+        os.fsync(fd)
+        os.replace(self.filename + ".tmp", self.filename)
+        self.unlock()
+        os.close(self.fd)
+        self.fd = fd
+        self.offset, self.n_rows = len(data), len(self.index)
+
+    def format_row(self, values):
+        line = io.StringIO()
+        csv.writer(line, delimiter=',', quoting=csv.QUOTE_MINIMAL, lineterminator='\n').writerow(values)
+        return line.getvalue().encode()
+
+    # Add rows appended since the file was last read (including by other processes) to the index
+    def read_new_rows(self):
+        size = os.fstat(self.fd).st_size
+        data = os.pread(self.fd, size - self.offset, self.offset)
+        # Only read complete lines
+        data = data[:data.rfind(b"\n") + 1]
+        rows = csv.reader(io.StringIO(data.decode("utf-8-sig")))
+        if self.offset == 0:
+            header = next(rows, None)
+            if header is not None and header != self.columns:
+                raise ValueError(f"Unexpected columns in {self.filename}: {header}")
+        for values in rows:
+            self.n_rows += 1
+            if len(values) != len(self.columns):
+                # Truncated by a crash
+                continue
+            row = dict(zip(self.columns, values))
+            key = row['URL'], row['Platform']
+            # Move re-saved sites to the end, so rows stay in the order they were last saved
+            self.index.pop(key, None)
+            self.index[key] = row
+        self.offset += len(data)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, url, platform):
+        return self.index.get((url, platform))
+
+    def rows(self):
+        return list(self.index.values())
+
+    # Append a row (a dict by column, or a list in column order), replacing any earlier row for the same site
+    def save(self, row):
+        values = [row[column] for column in self.columns] if isinstance(row, dict) else list(row)
+        line = self.format_row(values)
+        with self.thread_lock:
+            self.lock()
+            try:
+                # Catch up with rows from other writers first, so this row is the latest for its site
+                self.read_new_rows()
+                append_line(self.fd, line)
+                self.read_new_rows()
+                if self.n_rows > len(self.index):
+                    self.compact()
+            finally:
+                self.unlock()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+# Automatic annotation of quick exit buttons
+#
+# Loads sites in several headless browsers at once and picks out the most likely exit element on each page (by its
+# text, positioning and computed styles), describing it with the same columns as site_info.csv. Rows are saved to
+# site_info_auto.csv rather than site_info.csv, as they still need confirming by a person: button_info.py pre-fills its
+# form from them, and only saves a site to site_info.csv once it has been checked
+#
+# Run `auto_annotate.py [--browsers N] [--platform desktop|mobile|both] [--snapshots]`; with --snapshots, pages are
+# loaded from (and saved to) the offline snapshot store, see snapshots.py
+import csv
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
+import evaluate
+from annotation_store import AnnotationStore
+from site_list import parse_site_list, desktop_site_list, mobile_site_list
+from snapshots import SnapshotStore
+
+# Auto-annotated sites awaiting confirmation
+auto_info_filename = "./site_info_auto.csv"
+# Seconds to wait for a page to load before annotating whatever has loaded
+page_timeout = 20
+# Print throughput every this many sites
+report_every = 10
+
+# Text of a likely exit element
+exit_text = re.compile(r'\b(exit|leave|escape)\b|get me out|hide (this )?(page|site)|close (this )?(page|site)', re.I)
+
+# Find every element on the page whose text looks like an exit button, with its position and styles
+find_exit_candidates = """
+const pattern = new RegExp(arguments[0], 'i');
+const transparent = colour => !colour || colour === 'transparent' || /rgba\\(.*,\\s*0\\)$/.test(colour);
+const candidates = [];
+const selector = 'a, button, input[type=button], input[type=submit], [role=button], [onclick], img[alt]';
+for (const el of document.querySelectorAll(selector)) {
+    const text = (el.innerText || el.value || el.getAttribute('aria-label') || el.title || el.alt || '').trim();
+    const alt = Array.from(el.querySelectorAll('img[alt]')).map(img => img.alt).join(' ').trim();
+    const label = text || alt;
+    if (!label || label.length > 60 || !pattern.test(label)) {
+        continue;
+    }
+    const rect = el.getBoundingClientRect();
+    const style = getComputedStyle(el);
+    let sticky = false;
+    for (let e = el; e && e !== document.documentElement; e = e.parentElement) {
+        const position = getComputedStyle(e).position;
+        sticky = sticky || position === 'fixed' || position === 'sticky';
+    }
+    let background = null;
+    for (let e = el.parentElement; e && background === null; e = e.parentElement) {
+        const colour = getComputedStyle(e).backgroundColor;
+        background = transparent(colour) ? null : colour;
+    }
+    const displayed = rect.width > 0 && rect.height > 0 && style.visibility !== 'hidden';
+    let covered = false;
+    const x = rect.left + rect.width / 2, y = rect.top + rect.height / 2;
+    if (displayed && x >= 0 && y >= 0 && x < window.innerWidth && y < window.innerHeight) {
+        const top = document.elementFromPoint(x, y);
+        covered = top !== null && !el.contains(top) && !top.contains(el);
+    }
+    candidates.push({
+        label: label.replace(/\\s+/g, ' '), href: el.href || '', image: el.tagName === 'IMG' || (!text && alt !== ''),
+        menu: el.closest('nav, [role=navigation], [class*=menu], [id*=menu]') !== null,
+        x: rect.left, y: rect.top, width: rect.width, height: rect.height,
+        colour: transparent(style.backgroundColor) ? null : style.backgroundColor, text_colour: style.color,
+        background: background, sticky: sticky, displayed: displayed, covered: covered,
+    });
+}
+return {width: window.innerWidth, height: window.innerHeight, candidates: candidates};
+"""
+
+
+# Convert a css rgb(a) colour to the hex format used in site_info.csv
+def css_to_hex(colour, default='Transparent'):
+    if not colour:
+        return default
+    values = re.findall(r'[\d.]+', colour)
+    if len(values) < 3 or (len(values) > 3 and float(values[3]) == 0):
+        return default
+    return '#' + ''.join(f'{round(float(v)):02X}' for v in values[:3])
+
+
+# Order candidates from most to least likely to be the exit button
+def candidate_score(candidate):
+    return (candidate['displayed'] and not candidate['covered'],
+            candidate['sticky'],
+            re.search(r'\bexit\b', candidate['label'], re.I) is not None,
+            -len(candidate['label']))
+
+
+def classify_type(candidate, width):
+    if candidate['image']:
+        return 'image'
+    if candidate['menu'] and not candidate['sticky']:
+        return 'menu item'
+    if candidate['width'] >= 0.6 * width:
+        return 'banner'
+    if candidate['colour'] is None:
+        return 'text'
+    return 'button'
+
+
+def classify_size(candidate, button_type):
+    w, h = candidate['width'], candidate['height']
+    if button_type == 'text':
+        return 'text'
+    if w * h < 2000:
+        return 'small'
+    if w * h > 40000:
+        return 'large'
+    if w >= 4 * h:
+        return 'wide'
+    if h >= 2 * w:
+        return 'long'
+    return 'average'
+
+
+# Location on screen, as a 3x3 grid of the first screenful of the page
+def classify_location(candidate, width, height):
+    if not candidate['displayed']:
+        return 'side menu' if candidate['menu'] else 'dropdown'
+    x = candidate['x'] + candidate['width'] / 2
+    y = candidate['y'] + candidate['height'] / 2
+    if y >= height:
+        # Further down the page
+        return 'content'
+    column = 'left' if x < width / 3 else 'right' if x >= 2 * width / 3 else ''
+    row = 'top' if y < height / 3 else 'bottom' if y >= 2 * height / 3 else ''
+    return f'{row} {column}'.strip() or 'content'
+
+
+def classify_visibility(candidate, height):
+    if not candidate['displayed'] or candidate['y'] >= height or candidate['y'] + candidate['height'] <= 0:
+        return 'No'
+    # Covered on load, usually by a cookie notice
+    return 'Cookie Notice' if candidate['covered'] else 'Yes'
+
+
+# Describe the exit element found on a page as a site_info.csv row (see find_exit_candidates)
+def describe_exit_element(url, platform, found):
+    candidate = max(found['candidates'], key=candidate_score)
+    button_type = classify_type(candidate, found['width'])
+    return {
+        'URL': url, 'Platform': platform,
+        # Text buttons are described by their text colour
+        'Colour': css_to_hex(candidate['colour'] or candidate['text_colour']),
+        'Background Colour': css_to_hex(candidate['background'], '#FFFFFF'),
+        'Size': classify_size(candidate, button_type),
+        'Location': classify_location(candidate, found['width'], found['height']),
+        'Type': button_type,
+        'Sticky?': candidate['sticky'],
+        'Visible on load?': classify_visibility(candidate, found['height']),
+        'Label': candidate['label'],
+        # Hidden elements are in a menu, which needs opening first
+        'Clicks Required': '1' if candidate['displayed'] else '2',
+        'Goes To URL': candidate['href'],
+    }
+
+
+# Load a site and describe its exit element, or return None if none was found
+# If a SnapshotStore is given, the site is loaded from its snapshot if there is one, and a snapshot is saved otherwise
+def annotate_site(driver, site, snapshot_store=None):
+    try:
+        if snapshot_store is not None:
+            snapshot_store.load(driver, site.url, site.mobile_site)
+        else:
+            driver.get(site.url)
+    except evaluate.TimeoutException:
+        # Annotate whatever has loaded so far
+        pass
+    found = driver.execute_script(find_exit_candidates, exit_text.pattern)
+    if not found['candidates']:
+        return None
+    return describe_exit_element(site.url, 'Mobile' if site.mobile_site else 'Desktop', found)
+
+
+# Load auto-annotated rows by (url, platform)
+def load_auto_annotations(filename=auto_info_filename):
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "r", newline='') as f:
+        return {(row['URL'], row['Platform']): row for row in csv.DictReader(f)}
+
+
+# Annotate sites using n_browsers headless browsers at once, saving each row to auto_info_filename as it is found
+# Each browser takes the next site from a shared queue, so slow sites don't hold up the others
+# Returns the number of sites annotated, sites with no exit element found, and sites that failed to load
+def crawl(sites, n_browsers=4, filename=auto_info_filename, snapshot_store=None):
+    evaluate.load_webdriver()
+    work = queue.Queue()
+    for site in sites:
+        work.put(site)
+    lock = threading.Lock()
+    counts = {'annotated': 0, 'not found': 0, 'failed': 0}
+    start = time.perf_counter()
+
+    annotations = AnnotationStore(filename)
+    try:
+        def save(result, row=None):
+            if row is not None:
+                annotations.save(row)
+            with lock:
+                counts[result] += 1
+                done = sum(counts.values())
+                if done % report_every == 0:
+                    elapsed = time.perf_counter() - start
+                    print(f"{done}/{len(sites)} sites, {done / elapsed * 60:.1f} sites per minute")
+
+        def worker():
+            driver, mobile = None, None
+            try:
+                while True:
+                    try:
+                        site = work.get_nowait()
+                    except queue.Empty:
+                        return
+                    try:
+                        if driver is None or mobile != site.mobile_site:
+                            # Sites are queued by platform, so this only relaunches once when moving on to mobile
+                            if driver is not None:
+                                driver.quit()
+                            driver, mobile = None, site.mobile_site
+                            driver = evaluate.launch_browser(mobile, headless=True)
+                            driver.set_page_load_timeout(page_timeout)
+                        row = annotate_site(driver, site, snapshot_store)
+                        save('annotated' if row is not None else 'not found', row)
+                    except evaluate.WebDriverException as e:
+                        print(f"Failed to annotate {site.url}: {e.msg}")
+                        save('failed')
+                        # The browser may have crashed, so start a new one for the next site
+                        if driver is not None:
+                            try:
+                                driver.quit()
+                            except evaluate.WebDriverException:
+                                pass
+                        driver = None
+            finally:
+                if driver is not None:
+                    driver.quit()
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(n_browsers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        annotations.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Annotated {counts['annotated']} sites ({counts['not found']} with no exit element found, "
+          f"{counts['failed']} failed) in {elapsed:.0f}s: {len(sites) / max(elapsed, 1e-9) * 60:.1f} sites per minute")
+    return counts
+
+
+if __name__ == '__main__':
+    n_browsers = int(sys.argv[sys.argv.index('--browsers') + 1]) if '--browsers' in sys.argv else 4
+    platform = sys.argv[sys.argv.index('--platform') + 1] if '--platform' in sys.argv else 'both'
+    parse_site_list()
+    # Skip sites already annotated, either by a person or automatically
+    done = set(load_auto_annotations())
+    if os.path.exists(evaluate.site_info_filename):
+        with open(evaluate.site_info_filename, "r") as f:
+            done.update((row['URL'], row['Platform']) for row in csv.DictReader(f))
+    sites = []
+    if platform in ['desktop', 'both']:
+        sites += [site for site in desktop_site_list if (site.url, 'Desktop') not in done]
+    if platform in ['mobile', 'both']:
+        sites += [site for site in mobile_site_list if (site.url, 'Mobile') not in done]
+    print(f"Annotating {len(sites)} sites with {n_browsers} browsers")
+    crawl(sites, n_browsers, snapshot_store=SnapshotStore() if '--snapshots' in sys.argv else None)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+# Benchmarks for the annotation tool and analysis scripts
+#
+# Run `benchmarks.py` to run every benchmark that doesn't need chrome, or `benchmarks.py <name>` to run a single one
+# (including the browser benchmarks, which launch chrome and load live sites)
+import contextlib
+import csv
+import subprocess
+import sys
+import time
+
+# Modules that should only be imported once a browser is actually launched
+browser_modules = ['selenium', 'webdriver_manager', 'keyboard']
+
+
+# Time how long each script takes to import, and check that importing never sets up the browser / chrome driver
+def benchmark_startup(modules=('site_list', 'evaluate', 'significance_tests', 'agreement', 'logistic_regression'),
+                      repeats=5):
+    # Each import runs in a fresh interpreter so that nothing is already cached in sys.modules
+    probe = ("import sys, time\n"
+             "start = time.perf_counter()\n"
+             "import {module}\n"
+             "end = time.perf_counter()\n"
+             "import evaluate\n"
+             "loaded = [m for m in {browser_modules!r} if m in sys.modules]\n"
+             "print(end - start, evaluate.chrome_driver_path is None and not loaded, ','.join(loaded))\n")
+    results = {}
+    for module in modules:
+        times = []
+        for _ in range(repeats):
+            proc = subprocess.run([sys.executable, '-c', probe.format(module=module, browser_modules=browser_modules)],
+                                  capture_output=True, text=True)
+            if proc.returncode != 0:
+                # Missing analysis dependencies etc.; report the error rather than a time
+                times = None
+                print(f'{module}: failed to import ({proc.stderr.strip().splitlines()[-1]})')
+                break
+            elapsed, untouched, loaded = proc.stdout.split(' ')
+            times.append(float(elapsed))
+            if untouched != 'True':
+                print(f'{module}: WARNING browser set up on import (loaded {loaded.strip()})')
+        if times:
+            results[module] = min(times)
+            print(f'{module}: {min(times) * 1000:.1f}ms import time (best of {repeats}), chrome driver untouched')
+    return results
+
+
+# Time converting every colour in site_info.csv to a css3 colour name, one at a time and as a batch
+def benchmark_colour_names():
+    import logistic_regression
+    with open('site_info.csv', 'r') as f:
+        colours = [c for row in csv.DictReader(f) for c in (row['Colour'], row['Background Colour'])]
+
+    start = time.perf_counter()
+    _ = [logistic_regression.convert_rgb_to_names(c) for c in colours]
+    per_call = time.perf_counter() - start
+    logistic_regression.colour_name_cache.clear()
+    logistic_regression.colour_name_cache['Transparent'] = 'Transparent'
+    start = time.perf_counter()
+    _ = logistic_regression.convert_rgb_column_to_names(colours)
+    batch = time.perf_counter() - start
+    print(f'{len(colours)} colours ({len(set(colours))} unique): '
+          f'{per_call * 1000:.1f}ms one at a time, {batch * 1000:.1f}ms as a batch')
+    return per_call, batch
+
+
+# Time loading the first few desktop sites with each page readiness policy (needs chrome and a network connection)
+# With snapshots, pages are loaded from the offline snapshot store (see snapshots.py) once they have been saved
+def benchmark_page_readiness(n_sites=20, snapshots=False):
+    import evaluate
+    from snapshots import SnapshotStore
+    evaluate.parse_site_list()
+    evaluate.snapshot_store = SnapshotStore() if snapshots else None
+    sites = list(evaluate.desktop_site_list)[:n_sites]
+    evaluate.use_browser_pool = False
+    evaluate.use_prefetch = False
+    results = {}
+    for readiness in evaluate.page_load_strategies:
+        # The page load strategy is set when the browser launches, so start a fresh browser for each policy
+        evaluate.page_readiness = readiness
+        evaluate.desktop_browser()
+        evaluate.readiness_load_times.clear()
+        for site in sites:
+            evaluate.load_page(site.url, label=evaluate.exit_label(site))
+        load_times = evaluate.readiness_load_times[readiness]
+        # Policies fall back to "complete" for sites without a visible annotated label, or whose exit button isn't found
+        fallbacks = len(evaluate.readiness_load_times["complete"]) if readiness != "complete" else 0
+        results[readiness] = sum(load_times) / max(len(load_times), 1)
+        print(f'{readiness}: mean {results[readiness]:.2f}s over {len(load_times)} sites '
+              f'({fallbacks} fell back to complete)')
+        evaluate.close_browser()
+    evaluate.close_all_browsers()
+    return results
+
+
+# Page readiness benchmark with pages loaded from offline snapshots (run twice: the first run saves the snapshots)
+def benchmark_page_readiness_snapshots(n_sites=20):
+    return benchmark_page_readiness(n_sites, snapshots=True)
+
+
+# Time reading the URL of every open tab by switching to each tab in turn, and with a single DevTools call (needs chrome)
+def benchmark_tab_urls(n_tabs=5, repeats=20):
+    import evaluate
+    evaluate.use_browser_pool = False
+    driver = evaluate.desktop_browser()
+    for i in range(n_tabs - 1):
+        driver.execute_cdp_cmd("Target.createTarget", {"url": f"about:blank#{i}"})
+
+    def switching_tab_urls():
+        urls = {}
+        for handle in driver.window_handles:
+            driver.switch_to.window(handle)
+            urls[handle] = driver.current_url
+        return urls
+
+    results = {}
+    for name, read_urls in [('switching tabs', switching_tab_urls), ('Target.getTargets', evaluate.tab_urls)]:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            urls = read_urls()
+        results[name] = (time.perf_counter() - start) / repeats
+        print(f'{name}: {results[name] * 1000:.1f}ms per call for {len(urls)} tabs (mean of {repeats})')
+    evaluate.close_all_browsers()
+    return results
+
+
+# Time the chi squared tests for every platform x mechanism x grouping, one table at a time and all together
+def benchmark_chi_squared(repeats=20):
+    import numpy as np
+    import significance_tests as st
+    combinations = [(platform, mechanism, collapsed) for platform in st.platforms for mechanism in st.mechanisms
+                    for collapsed in [False, True]]
+    start = time.perf_counter()
+    for _ in range(repeats):
+        per_call = {c: st.chi_squared_tests(*c, draw=False) for c in combinations}
+    per_call_time = (time.perf_counter() - start) / repeats
+    start = time.perf_counter()
+    for _ in range(repeats):
+        results = st.chi_squared_all()
+    batch_time = (time.perf_counter() - start) / repeats
+
+    # Check both give the same statistics
+    for (platform, mechanism, collapsed), legacy in per_call.items():
+        p, m = st.platforms.index(platform), st.mechanisms.index(mechanism)
+        country, category = results['country'], results['collapsed category' if collapsed else 'category']
+        batched = (country['chi2'][p, m], country['dof'], country['p'][p, m],
+                   category['chi2'][p, m], category['dof'], category['p'][p, m])
+        if not np.allclose(legacy, batched, equal_nan=True):
+            print(f'WARNING: results differ for {platform} {mechanism} (collapsed={collapsed}): {legacy} {batched}')
+    print(f'{len(combinations)} tests: {per_call_time * 1000:.2f}ms one at a time, '
+          f'{batch_time * 1000:.2f}ms all together (mean of {repeats})')
+    return per_call_time, batch_time
+
+
+# Run in a temporary directory holding copies of site_info.csv and the survey, and a stub timing results file per
+# annotator (the real ones aren't in the repository), with random timings for every site in site_info.csv
+@contextlib.contextmanager
+def analysis_inputs(seed=0):
+    import json
+    import os
+    import random
+    import shutil
+    import tempfile
+    import logistic_regression as lr
+    rng = random.Random(seed)
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp()
+    try:
+        for filename in ['site_info.csv', lr.survey_filename]:
+            shutil.copy(filename, directory)
+        os.chdir(directory)
+        with open('site_info.csv', 'r') as f:
+            sites = {(row['URL'], row['Platform']) for row in csv.DictReader(f)}
+        tests = ['learn_button_time', 'recall_button_time', 'learn_shortcut_time', 'recall_shortcut_time',
+                 'learn_explainer_time', 'recall_explainer_time']
+        for filename in lr.timing_filenames:
+            evaluated = [{'url': url, 'is_mobile': platform == 'Mobile', **{test: rng.uniform(1, 30) for test in tests}}
+                         for url, platform in sorted(sites)]
+            with open(filename, 'w') as f:
+                json.dump({'name': '', 'evaluated': evaluated}, f)
+        yield directory
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+
+# Time building the logistic regression dataset from scratch, from an up to date cache, and after changing rows of
+# site_info.csv (including duplicating one), checking the cached builds match building from scratch
+def benchmark_feature_cache():
+    import os
+    import pandas as pd
+    import logistic_regression as lr
+    with analysis_inputs():
+        with open('site_info.csv', 'r') as f:
+            lines = f.readlines()
+
+        def build(label, from_scratch):
+            if from_scratch and os.path.exists(lr.feature_cache_filename):
+                os.remove(lr.feature_cache_filename)
+            start = time.perf_counter()
+            data = lr.combine_data()
+            print(f'{label}: {(time.perf_counter() - start) * 1000:.1f}ms')
+            return data
+
+        build('from scratch', True)
+        build('cached', False)
+        # Duplicate a row, then (with duplicate rows in the cache) change another
+        duplicated = lines + [lines[1]]
+        changed = lines[:2] + [lines[2].replace(',True,', ',False,', 1)] + lines[3:] + [lines[1]]
+        results = {}
+        for label, edited in [('duplicate row', duplicated), ('changed row', changed)]:
+            with open('site_info.csv', 'w') as f:
+                f.writelines(edited)
+            results[label] = build(f'after {label}', False)
+            # Also leaves a cache built from scratch for the next edit
+            pd.testing.assert_frame_equal(results[label], build('    from scratch', True))
+        return results
+
+
+# Time cross validating the button regressions, on the dataset and on larger datasets made by resampling its sites
+# (with stub timing results, see analysis_inputs)
+def benchmark_model_selection(scales=(1, 2, 4), outcomes=('button-discover', 'learn_button_time'), k=5):
+    import numpy as np
+    import logistic_regression as lr
+    with analysis_inputs():
+        data = lr.combine_data()
+    rng = np.random.default_rng(0)
+    results = {}
+    for scale in scales:
+        sample = data if scale == 1 else data.iloc[rng.integers(len(data), size=len(data) * scale)]
+        for ycol in outcomes:
+            start = time.perf_counter()
+            stats = lr.cross_validate(sample, ycol, k=k)
+            elapsed = time.perf_counter() - start
+            results[len(sample), ycol] = stats
+            print(f'{len(sample)} sites, {ycol}: {elapsed:.2f}s for {len(stats)} thresholds x {k} folds')
+            for threshold, s in stats.items():
+                print(f'    threshold {threshold}: RFE {s["rfe_time"]:.2f}s, logit {s["logit_time"]:.2f}s '
+                      f'(accuracy {s["accuracy"]:.3f}, AUC {s["auc"]:.3f})')
+    return results
+
+
+# Time removing completed sites from a synthetic site list (as when resuming a session) with a plain list of Site-s and
+# with a SiteRegistry. The list is quadratic, so it is only timed on the first list_sites sites
+def benchmark_site_registry(n_sites=100000, completed=0.95, list_sites=5000):
+    import random
+    from site_list import Site, SiteRegistry
+    sites = [Site(f'https://site{i}.example/', mobile_site=i % 2 == 1) for i in range(n_sites)]
+    done = random.Random(0).sample(sites, int(n_sites * completed))
+
+    small_sites = sites[:list_sites]
+    small_keys = {s.key() for s in small_sites}
+    small_done = [Site(s.url, s.mobile_site) for s in done if s.key() in small_keys]
+    start = time.perf_counter()
+    remaining = list(small_sites)
+    for cs in small_done:
+        if cs in remaining:
+            remaining.remove(cs)
+    list_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    registry = SiteRegistry(sites)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for cs in done:
+        registry.discard((cs.url, cs.mobile_site))
+    registry_time = time.perf_counter() - start
+    print(f'list: {list_time * 1000:.1f}ms to remove {len(small_done)} of {list_sites} sites '
+          f'({len(remaining)} remaining)')
+    print(f'registry: {registry_time * 1000:.1f}ms to remove {len(done)} of {n_sites} sites '
+          f'({len(registry)} remaining), {build_time * 1000:.1f}ms to build')
+    return list_time, registry_time
+
+
+benchmarks = {
+    'startup': benchmark_startup,
+    'colour_names': benchmark_colour_names,
+    'page_readiness': benchmark_page_readiness,
+    'page_readiness_snapshots': benchmark_page_readiness_snapshots,
+    'tab_urls': benchmark_tab_urls,
+    'chi_squared': benchmark_chi_squared,
+    'feature_cache': benchmark_feature_cache,
+    'model_selection': benchmark_model_selection,
+    'site_registry': benchmark_site_registry,
+}
+# Benchmarks that launch chrome, only run when named
+browser_benchmarks = ['page_readiness', 'page_readiness_snapshots', 'tab_urls']
+
+if __name__ == '__main__':
+    selected = sys.argv[1:] if len(sys.argv) > 1 else [name for name in benchmarks if name not in browser_benchmarks]
+    for name in selected:
+        print(f'--- {name} ---')
+        benchmarks[name]()
@@ -1,21 +1,25 @@
-import csv
 from functools import reduce
 from collections import defaultdict
-import os
+import queue
 import tkinter as tk
 import threading
 import time
 from sys import exit
 from statistics import stdev, median, mean
 
-from evaluate import Site, parse_site_list, desktop_site_list, mobile_site_list, sitelist_filename
-from evaluate import desktop_browser, mobile_browser, cleanup_browser
+from site_list import parse_site_list, desktop_site_list, mobile_site_list, sitelist_filename
+from evaluate import desktop_browser, mobile_browser, cleanup_browser, close_all_browsers, prefetch_site, close_prefetch, \
+    tab_urls, warm_browser
+from annotation_store import AnnotationStore
+from auto_annotate import load_auto_annotations
 
 browser = None
 state = {}
 buttons = []
 entry_vars = {}
 default_buttons = []
+# Automatic annotations awaiting confirmation, by (url, platform)
+auto_annotations = {}
 def reset_state():
     global state
     state = {
@@ -91,8 +95,7 @@ def click_visible_btn(visible):
             btn.configure(bg='#ffffff')
 
 def click_url_btn():
-    global browser
-    browser.get(entry_vars['url'].get())
+    run_in_browser(open_page, entry_vars['url'].get(), entry_vars['platform'].get())
 
 def click_text_btn():
     click_type_btn("text")
@@ -107,24 +110,25 @@ def click_menu_button():
 
 landing_entry = None
 def save_landing_sites():
-    global browser
-    state['landing'] = []
-    for handle in browser.window_handles:
-        browser.switch_to.window(handle)
-        state['landing'].append(browser.current_url)
+    run_in_browser(read_tab_urls, callback=set_landing_sites)
+
+# URLs of all open tabs (except the next site, loading in the background)
+def read_tab_urls():
+    return [url for handle, url in tab_urls(browser).items() if handle != prefetch_tab]
+
+def set_landing_sites(urls):
+    state['landing'] = urls
     combined_list = ';'.join(state['landing'])
     entry_vars['landing'].set(combined_list)
 
 mechanism_info_filename = 'site_info.csv'
+# Saved annotations (see annotation_store.py), opened at startup
+annotation_store = None
 def load_completed_annotations():
-    if not os.path.exists(mechanism_info_filename):
-        return "", {}
-    urls = []
-    with open(mechanism_info_filename, "r") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            urls.append((row['URL'], row['Platform']))
-    return urls
+    global annotation_store
+    if annotation_store is None:
+        annotation_store = AnnotationStore(mechanism_info_filename)
+    return list(annotation_store.index)
 
 def save_completed_annotation():
     # Build record from variables
@@ -140,10 +144,8 @@ def save_completed_annotation():
         entry_vars['label'].get(), entry_vars['clicks to exit'].get(), entry_vars['landing'].get()
     ]
     #print(record)
-    # Convert to csv and write to file
-    with open(mechanism_info_filename, "a", newline='') as f:
-        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_MINIMAL)
-        writer.writerow(record)
+    # Append to file
+    annotation_store.save(record)
 
 def make_eval_window():
     global landing_entry
@@ -262,23 +264,106 @@ def make_eval_window():
 
     return window
 
-def set_site(site, platform):
+# Fill in the form from a site's automatic annotation (see auto_annotate.py), for the annotator to check
+def prefill_site(row):
+    entry_vars['colour'].set(row['Colour'])
+    entry_vars['background colour'].set(row['Background Colour'])
+    click_size_btn(row['Size'])
+    click_loc_btn(row['Location'])
+    click_type_btn(row['Type'])
+    click_sticky_btn('Yes' if row['Sticky?'] == 'True' else 'No')
+    click_visible_btn(row['Visible on load?'])
+    entry_vars['label'].set(row['Label'])
+    entry_vars['clicks to exit'].set(row['Clicks Required'])
+    entry_vars['landing'].set(row['Goes To URL'])
+
+# Browser commands, run in order on a worker thread so that the window stays responsive while pages load
+browser_commands = queue.Queue()
+# Results of browser commands, with the callbacks to hand them to on the window's thread (see poll_browser_results)
+browser_results = queue.Queue()
+
+def browser_worker():
+    while True:
+        command, args, callback = browser_commands.get()
+        if command is None:
+            return
+        try:
+            result = command(*args)
+        except Exception as e:
+            print(f"Browser command {command.__name__} failed: {e}")
+            continue
+        if callback is not None:
+            browser_results.put((callback, result))
+
+# Queue a command for the browser worker; callback is called with its result on the window's thread
+def run_in_browser(command, *args, callback=None):
+    browser_commands.put((command, args, callback))
+
+def poll_browser_results(root):
+    while True:
+        try:
+            callback, result = browser_results.get_nowait()
+        except queue.Empty:
+            break
+        callback(result)
+    root.after(50, poll_browser_results, root)
+
+# Background tab loading the next site while the current one is annotated (see evaluate.prefetch_site)
+prefetch_tab = None
+
+def start_browser(platform):
     global browser
+    browser = mobile_browser() if platform == 'Mobile' else desktop_browser()
+
+# Load a site, then start loading the site after it in the background
+def load_site(site, platform, next_site):
+    global prefetch_tab
+    open_page(site.url, platform)
+    if next_site is not None and next_site.mobile_site == site.mobile_site:
+        prefetch_tab = prefetch_site(next_site)
+
+# Close extra tabs (including the prefetch tab) before the next site
+def clear_tabs():
+    global prefetch_tab
+    if prefetch_tab is not None:
+        close_prefetch(prefetch_tab)
+        prefetch_tab = None
+    cleanup_browser()
+
+# Next two sites to annotate, as (site, platform) or None
+def upcoming_sites():
+    upcoming = [(site, 'Desktop') for site in desktop_site_list.head(2)] + \
+               [(site, 'Mobile') for site in mobile_site_list.head(2)]
+    upcoming += [None, None]
+    return upcoming[0], upcoming[1]
+
+def set_site(site, platform, next_site=None):
     entry_vars['url'].set(site.url)
     entry_vars['platform'].set(platform)
-    browser.get(site.url)
+    if (site.url, platform) in auto_annotations:
+        prefill_site(auto_annotations[site.url, platform])
+    run_in_browser(load_site, site, platform, next_site)
+    if platform == 'Desktop' and next_site is not None and next_site.mobile_site:
+        # Last desktop site, so start the mobile browser while it is annotated (no timing tests run here, so the launch
+        # can't skew any results)
+        run_in_browser(warm_browser, True)
+
+# Load a site in the browser
+# Always the live site, not an offline snapshot (see snapshots.py): snapshots don't run scripts, so menus wouldn't open
+# and exit buttons wouldn't work, and the clicks required and where the button goes couldn't be checked
+def open_page(url, platform):
+    browser.get(url)
 
 def save_and_next():
-    global browser
     # Save this annotation
     save_completed_annotation()
 
     # Remove the completed site
     current_platform = entry_vars['platform'].get()
     if current_platform == 'Desktop':
-        del desktop_site_list[0]
+        desktop_site_list.pop_first()
     elif current_platform == 'Mobile':
-        del mobile_site_list[0]
+        mobile_site_list.pop_first()
     else:
         raise Exception('Invalid current platform: '+current_platform)
     print(f"You have {len(desktop_site_list)} desktop sites and {len(mobile_site_list)} mobile sites remaining.")
@@ -286,22 +371,19 @@ def save_and_next():
     # Reset variables
     reset_state()
     # Cleanup extra tabs etc
-    cleanup_browser()
+    run_in_browser(clear_tabs)
 
-    # Go to next site
-    if len(desktop_site_list) > 0:
-        set_site(desktop_site_list[0], 'Desktop')
-    elif len(mobile_site_list) > 0:
-        if current_platform == 'Desktop':
-            entry_vars['platform'] = 'Mobile'
-            browser.quit()
-            browser = mobile_browser()
-        set_site(mobile_site_list[0], 'Mobile')
-    else:
-        if browser:
-            browser.quit()
+    # Go to next site (the form is filled in straight away, while the browser catches up)
+    current, following = upcoming_sites()
+    if current is None:
         print("You're done with annotations!")
-        exit(0)
+        root.quit()
+        return
+    site, platform = current
+    if platform != current_platform:
+        # Hand over to the mobile browser, started while the last desktop site was annotated (see set_site)
+        run_in_browser(start_browser, platform)
+    set_site(site, platform, following[0] if following is not None else None)
 
 def get_annotation_stats():
     timing_qs = ['learn_button_time', 'recall_button_time', 'learn_shortcut_time', 'recall_shortcut_time',
@@ -326,17 +408,17 @@ if __name__ == '__main__':
     #combine_data()
 
     parse_site_list()
+    auto_annotations = load_auto_annotations()
     # Make window
     root = make_eval_window()
 
     # Read list of sites to annotate
     annotated = load_completed_annotations()
     for (url, platform) in annotated:
-        cs = Site(url, mobile_site=(platform=='Mobile'))
-        if platform == 'Desktop' and cs in desktop_site_list:
-            desktop_site_list.remove(cs)
-        elif platform == 'Mobile' and cs in mobile_site_list:
-            mobile_site_list.remove(cs)
+        if platform == 'Desktop':
+            desktop_site_list.discard((url, False))
+        elif platform == 'Mobile':
+            mobile_site_list.discard((url, True))
         else:
             raise Exception("Unknown platform: " + platform)
     print(f"You have {len(desktop_site_list)} desktop sites and {len(mobile_site_list)} mobile sites remaining.")
@@ -345,18 +427,20 @@ if __name__ == '__main__':
     reset_state()
 
     # Initialise browser
-    if len(desktop_site_list) > 0:
-        browser = desktop_browser()
-        set_site(desktop_site_list[0], 'Desktop')
-    elif len(mobile_site_list) > 0:
-        browser = mobile_browser()
-        set_site(mobile_site_list[0], 'Mobile')
-    else:
+    current, following = upcoming_sites()
+    if current is None:
         print("You're done with annotations!")
         exit(0)
+    worker = threading.Thread(target=browser_worker, daemon=True)
+    worker.start()
+    run_in_browser(start_browser, current[1])
+    set_site(current[0], current[1], following[0] if following is not None else None)
 
     # Go into UI loop
+    poll_browser_results(root)
     root.mainloop()
 
-    # Cleanup on exit
-    browser.quit()
+    # Cleanup on exit, once the worker has finished any queued commands
+    browser_commands.put((None, (), None))
+    worker.join()
+    close_all_browsers()
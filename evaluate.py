@@ -4,25 +4,24 @@
 #
 # Creates an environment for evaluators to automatically work through a list of sites to evaluate
 # Stores results in a file for later
-from selenium.webdriver import Chrome
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.common.exceptions import NoAlertPresentException, TimeoutException, WebDriverException
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-
+import csv
 import json
 import os
-import random
+import re
+import sys
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from time import time_ns, sleep
-import keyboard
+from urllib.parse import urlsplit
+
+from site_list import parse_site_list, desktop_site_list, mobile_site_list, sitelist_filename
 
 # Globals
 # Saved progress filename
 state_filename = "./evaluation.json"
-sitelist_filename = "./exit_button_sites.csv"
+# Journal of results saved since the state file was last compacted (one JSON object per line)
+journal_filename = "./evaluation.jsonl"
 evaluator_name = ""
 # URLs
 blank_site = "https://www.google.com/blank.html"
@@ -33,50 +32,77 @@ shortcut_prompt = "Please locate and press the quick exit shortcut on the follow
 help_prompt = "Please locate and click on the link to the explainer text on the following website"
 # Store if browser is currently mobile or desktop
 using_mobile = False
-# Install and save chrome driver for launching browser instances
-os.environ['WDM_LOG_LEVEL'] = '0'  # Silence logs
-chrome_driver_service = Service(ChromeDriverManager().install())
-# Store websites to evaluate (will be populated on load)
-desktop_site_list = []
-mobile_site_list = []
-
-
-# Class for sites that will be evaluated
-class Site:
-    def __init__(self, url, mobile_site=False, shortcut=None,
-                 has_button=True, has_explainer=False, safe_browsing_url=None):
-        self.url = url
-        self.mobile_site = mobile_site
-        self.shortcut = shortcut
-        self._has_explainer = has_explainer
-        self.safe_browsing_url = safe_browsing_url
-        self._has_button = has_button
-
-    # Print string of
-    def __str__(self):
-        return f'[{"mobile" if self.mobile_site else "desktop"}]{self.url} | ' \
-               f'contains [{"button," if self.has_button() else ""}{"shortcut," if self.has_shortcut() else ""}' \
-               f'{"explainer," if self.has_explainer() else ""}{"safety" if self.has_safe_browsing_page() else ""}] | '\
-               f'shortcut = {self.shortcut if self.has_shortcut() else "N/A"} | ' \
-               f'safe browsing page = {self.safe_browsing_url if self.has_safe_browsing_page() else "N/A"} '
-
-    def __repr__(self):
-        return self.__str__()
-
-    def __eq__(self, other):
-        return self.url == other.url and self.mobile_site == other.mobile_site
-
-    def has_button(self):
-        return self._has_button
-
-    def has_shortcut(self):
-        return self.shortcut is not None
-
-    def has_explainer(self):
-        return self._has_explainer
-
-    def has_safe_browsing_page(self):
-        return self.safe_browsing_url is not None
+# Methods for timing tests: "python" (harness clock around WebDriver polls), "events" (chrome performance log),
+# "keyboard" (keyboard hook, shortcut tests only) and "browser" (performance.now() recorded by a script in the page)
+timing_methods = ["browser", "events", "keyboard", "python"]
+# Timing method saved as the result of each test (the difference from the other methods is saved as overhead)
+# "python" is what learn_*/recall_* times have always measured (alert closed to navigation seen by the harness); the
+# method actually used for each result is saved alongside it, as it falls back to another if unavailable
+timing_mode = "python"
+# Current browser instance
+browser = None
+# Start the mobile browser (minimised) while the evaluator takes a break after the last desktop site, so that switching
+# platform doesn't wait for chrome to start (see switch_browser)
+use_browser_pool = True
+# Spare browser instances (as futures, while they launch in the background) by platform (True if mobile)
+browser_pool = {}
+browser_pool_executor = ThreadPoolExecutor(max_workers=2)
+# Load the next site in a hidden window while the evaluator fills in the survey (see prefetch_site)
+use_prefetch = True
+# URLs of sites that have been prefetched, and first load times of sites with and without prefetching (for logging)
+prefetched_urls = set()
+prefetch_load_times = {True: [], False: []}
+prefetch_hits = []
+# Stats for pages loaded by load_page (see page_load_stats), recorded for the site being evaluated
+page_loads = []
+# When load_page considers a page ready: "complete" (all resources loaded), "interactive" (DOM parsed) or "exit-element"
+# (the exit button, found by its label in site_info.csv, is visible)
+page_readiness = "complete"
+# Chrome page load strategy for each readiness policy, so that browser.get returns early enough to apply it
+page_load_strategies = {"complete": "normal", "interactive": "eager", "exit-element": "none"}
+# Seconds to look for the exit button before falling back to waiting for the full page (e.g. if its label has changed
+# since annotation, or is split across elements)
+exit_element_timeout = 10
+# Time taken by load_page for each readiness policy
+readiness_load_times = defaultdict(list)
+# Offline page snapshots to load pages from instead of the live sites (see snapshots.py), or None to load live sites
+# Snapshots don't run scripts, so this is only for page load benchmarks and never for the timing tests
+snapshot_store = None
+# Exit button labels by (url, platform), loaded from site_info.csv when first needed
+site_info_filename = "./site_info.csv"
+exit_labels = None
+# Size of the emulated mobile screen
+mobile_width = 360
+mobile_height = 640
+# Chrome driver for launching browser instances (installed on first browser launch, see load_webdriver)
+chrome_driver_path = None
+# Selenium classes (imported on first browser launch, see load_webdriver)
+Chrome = Service = Options = By = EC = WebDriverWait = None
+NoAlertPresentException = TimeoutException = WebDriverException = JavascriptException = None
+
+
+# Import selenium and install the chrome driver, if not already done
+# Deferred until a browser is needed so that importing this module (e.g. for the site list) stays cheap and offline
+def load_webdriver():
+    global chrome_driver_path, Chrome, Service, Options, By, EC, WebDriverWait
+    global NoAlertPresentException, TimeoutException, WebDriverException, JavascriptException
+    if chrome_driver_path is not None:
+        return chrome_driver_path
+
+    from selenium.webdriver import Chrome
+    from webdriver_manager.chrome import ChromeDriverManager
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.common.by import By
+    from selenium.common.exceptions import NoAlertPresentException, TimeoutException, WebDriverException, \
+        JavascriptException
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    # Install and save chrome driver for launching browser instances
+    os.environ['WDM_LOG_LEVEL'] = '0'  # Silence logs
+    chrome_driver_path = ChromeDriverManager().install()
+    return chrome_driver_path
 
 
 # Expected Condition for an alert to not be present
@@ -95,26 +121,81 @@ class AnyTabContainsSafeBrowsingUrl(object):
         self._site = site
 
     def __call__(self, driver):
-        for handle in browser.window_handles:
-            browser.switch_to.window(handle)
-            if self._site.safe_browsing_url in browser.current_url:
+        return any(self._site.safe_browsing_url in url for url in tab_urls(driver).values())
+
+
+# Normalise a URL to its host, so that scheme and www. prefixes are ignored when comparing sites
+def url_host(url):
+    host = urlsplit(url).hostname or ""
+    return host[4:] if host.startswith("www.") else host
+
+
+# Wait condition for the main frame to navigate to a different host
+# Reads navigation events from chrome's performance log rather than polling current_url, and records when the alert was
+# dismissed and the navigation was requested, in milliseconds. These are the times chromedriver received the events from
+# chrome, not when the renderer raised them, so they leave out polling latency but not chromedriver's. The navigation
+# time is when the page asked to navigate (Page.frameRequestedNavigation, e.g. the exit button was clicked), not when
+# the new page was committed (Page.frameNavigated), which would add the new site's server response time to the timing
+class NavigatedAwayFrom(object):
+    def __init__(self, url):
+        self._host = url_host(url)
+        self._main_frame = None
+        self._requested = None
+        self.dialog_closed = None
+        self.navigated = None
+
+    # Discard all events logged so far, and find the main frame's id to recognise its navigation requests
+    def drain(self, driver):
+        _ = driver.get_log("performance")
+        self._main_frame = driver.execute_cdp_cmd("Page.getFrameTree", {})["frameTree"]["frame"]["id"]
+
+    def __call__(self, driver):
+        for entry in driver.get_log("performance"):
+            message = json.loads(entry["message"])["message"]
+            params = message["params"]
+            if message["method"] == "Page.javascriptDialogClosed":
+                self.dialog_closed = entry["timestamp"]
+            elif (message["method"] == "Page.frameRequestedNavigation" and params["frameId"] == self._main_frame and
+                  url_host(params["url"]) != self._host):
+                self._requested = entry["timestamp"]
+            elif (message["method"] == "Page.frameNavigated" and "parentId" not in params["frame"] and
+                  url_host(params["frame"]["url"]) != self._host):
+                # Only finished once the navigation has committed, as a requested navigation may still be cancelled
+                # Navigations chrome doesn't report requesting (e.g. typed into the address bar) are timed by the commit
+                self.navigated = self._requested if self._requested is not None else entry["timestamp"]
                 return True
-        # else, default to whatever tab we were already in, and return flag indicating it was not found
-        else:
-            return False
+        return False
 
 
 # Open file containing results, progress so far as JSON
 def load_state():
-    if not os.path.exists(state_filename):
+    if not os.path.exists(state_filename) and not os.path.exists(journal_filename):
         return "", {}
 
-    with open(state_filename, "r") as f:
-        # Parse JSON into dictionary
-        data = json.load(f)
-    # Parse main variables into dictionary
-    name = data["name"]
-    evaluated = data["evaluated"]
+    name, evaluated = "", []
+    if os.path.exists(state_filename):
+        with open(state_filename, "r") as f:
+            # Parse JSON into dictionary
+            data = json.load(f)
+        # Parse main variables into dictionary
+        name = data["name"]
+        evaluated = data["evaluated"]
+    # Replay any results saved to the journal since the last compaction
+    if os.path.exists(journal_filename):
+        seen = {(res["url"], res["is_mobile"]) for res in evaluated}
+        with open(journal_filename, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partially written line from a crash; the site will be evaluated again
+                    continue
+                if "name" in record:
+                    name = record["name"]
+                elif (record["url"], record["is_mobile"]) not in seen:
+                    # Skip results already folded into the state file (crash during compaction)
+                    seen.add((record["url"], record["is_mobile"]))
+                    evaluated.append(record)
     return name, evaluated
 
 
@@ -125,54 +206,51 @@ def save_state(name, evaluated):
         "name": name,
         "evaluated": evaluated,
     }
-    # Convert to JSON and write to file
-    with open(state_filename, "w") as f:
+    # Convert to JSON and write to a temporary file, then swap it in so the old state survives a crash mid-write
+    with open(state_filename + ".tmp", "w") as f:
         json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(state_filename + ".tmp", state_filename)
+
+
+# Append a complete line to a file opened with O_RDWR | O_APPEND, syncing it to disk before returning
+# Also used by annotation_store.py for site_info.csv
+def append_line(fd, line):
+    size = os.fstat(fd).st_size
+    # (lseek + read rather than pread, which isn't available on Windows)
+    if size > 0 and os.lseek(fd, size - 1, os.SEEK_SET) >= 0 and os.read(fd, 1) != b"\n":
+        # Terminate a line truncated by a crash so it doesn't swallow this one
+        line = b"\n" + line
+    # Single write of a complete line, so a crash can at worst leave one truncated (ignored) line
+    os.write(fd, line)
+    os.fsync(fd)
+
+
+# Append a single line to the journal, syncing it to disk before returning
+def append_journal(record):
+    fd = os.open(journal_filename, os.O_RDWR | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        append_line(fd, (json.dumps(record) + "\n").encode())
+    finally:
+        os.close(fd)
+
+
+# Save the result for a single site by appending it to the journal
+def save_result(name, res):
+    if not os.path.exists(journal_filename):
+        append_journal({"name": name})
+    append_journal(res)
 
 
-# Parse site list into arrays of Site-s
-def parse_site_list():
-    global desktop_site_list, mobile_site_list
-
-    with open(sitelist_filename, "r") as f:
-        data = map(lambda l: l.split(","), f.readlines()[1:])
-
-        for site in data:
-            # Read fields from CSV
-            url = site[0]
-            if url == "":
-                # blank or analytics row
-                continue
-            # category = site[1]
-            # region = site[2]
-            has_desktop_button = site[3] != ""
-            has_mobile_button = site[4] != ""
-            # shortcut_type = site[5]
-            desktop_shortcut = site[6] if site[6] != "" else None
-            mobile_shortcut = site[7] if site[7] != "" else None
-            explainer_text = site[8] != ""
-            safe_browsing_url = site[9] if site[9] != "" else None
-            # comments = site[10]
-
-            # Add to relevant list(s)
-            if has_desktop_button or desktop_shortcut is not None:
-                desktop_site_list.append(Site(
-                    url,
-                    mobile_site=False,
-                    has_button=has_desktop_button,
-                    shortcut=desktop_shortcut,
-                    has_explainer=explainer_text,
-                    safe_browsing_url=safe_browsing_url,
-                ))
-            if has_mobile_button or mobile_shortcut is not None:
-                mobile_site_list.append(Site(
-                    url,
-                    mobile_site=True,
-                    has_button=has_mobile_button,
-                    shortcut=mobile_shortcut,
-                    has_explainer=explainer_text,
-                    safe_browsing_url=safe_browsing_url,
-                ))
+# Fold the journal back into the state file (the format read by the analysis scripts)
+def compact_state():
+    name, evaluated = load_state()
+    if "" == name and not evaluated:
+        return
+    save_state(name, evaluated)
+    if os.path.exists(journal_filename):
+        os.remove(journal_filename)
 
 
 # Close browser instance safely
@@ -180,9 +258,10 @@ def close_browser():
     global browser
     try:
         browser.quit()
-    except NameError or AttributeError:
+    except (NameError, AttributeError):
         # Browser not yet instantiated / already closed: no action needed
         pass
+    browser = None
 
 
 # Close all tabs but one
@@ -197,55 +276,322 @@ def cleanup_browser():
 # Find a certain tab
 def find_tab(tab_substr):
     global browser
-    for handle in browser.window_handles:
-        browser.switch_to.window(handle)
-        if tab_substr in browser.current_url:
+    for handle, url in tab_urls().items():
+        if tab_substr in url:
+            browser.switch_to.window(handle)
             return True
-    # else, default to whatever tab we were already in, and return flag indicating it was not found
+    # else, stay in whatever tab we were already in, and return flag indicating it was not found
     else:
         return False
 
-# Make a mobile browser
-def mobile_browser():
-    global browser, using_mobile
-    close_browser()
 
-    width = 360
-    height = 640
+# URLs of all open tabs by window handle, read in a single DevTools call without switching tabs
+# (chromedriver uses each tab's DevTools target id as its window handle)
+def tab_urls(driver=None):
+    driver = driver or browser
+    targets = driver.execute_cdp_cmd("Target.getTargets", {})["targetInfos"]
+    return {target["targetId"]: target["url"] for target in targets if target["type"] == "page"}
+
+
+# Launch a new mobile browser instance
+def launch_mobile_browser(headless=False):
+    load_webdriver()
+    width = mobile_width
+    height = mobile_height
     mobile_emulation = {
         "deviceMetrics": {"width": width, "height": height, "pixelRatio": 3.0},
         "userAgent": "Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 (KHTML, like Gecko) "
                      "Chrome/99.0.4844.84 Mobile Safari/537.36"}
     options = Options()
     options.add_experimental_option("mobileEmulation", mobile_emulation)
+    if headless:
+        options.add_argument("--headless=new")
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option('useAutomationExtension', False)
-    browser = Chrome(service=chrome_driver_service, options=options)
-    browser.set_window_size(width, height+150)
-    using_mobile = True
+    # Log page events and console messages, used for timing tests (see NavigatedAwayFrom and timing_alert)
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL", "browser": "ALL"})
+    # Only page events are needed, so leave out network events, which are most of the log on a page load
+    options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": False})
+    options.page_load_strategy = page_load_strategies[page_readiness]
+    # Each instance needs its own driver service, as pooled browsers run side by side
+    mobile = Chrome(service=Service(chrome_driver_path), options=options)
+    mobile.set_window_size(width, height+150)
+    return mobile
+
+
+# Launch a new desktop browser instance
+def launch_desktop_browser(headless=False):
+    load_webdriver()
+    options = Options()
+    if headless:
+        # Headless windows can't be maximised, so use a typical desktop screen size
+        options.add_argument("--headless=new")
+        options.add_argument("--window-size=1920,1080")
+    else:
+        options.add_argument("start-maximized")
+    options.add_argument("--disable-blink-features=AutomationControlled")
+    options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    options.add_experimental_option('useAutomationExtension', False)
+    # Log page events and console messages, used for timing tests (see NavigatedAwayFrom and timing_alert)
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL", "browser": "ALL"})
+    # Only page events are needed, so leave out network events, which are most of the log on a page load
+    options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": False})
+    options.page_load_strategy = page_load_strategies[page_readiness]
+    # Each instance needs its own driver service, as pooled browsers run side by side
+    return Chrome(service=Service(chrome_driver_path), options=options)
+
+
+def launch_browser(mobile, headless=False):
+    return launch_mobile_browser(headless) if mobile else launch_desktop_browser(headless)
+
+
+# Check a browser instance is still usable (e.g. hasn't crashed or been closed by the evaluator)
+def browser_is_alive(driver):
+    try:
+        _ = driver.window_handles
+        return True
+    except:
+        return False
+
+
+# Launch a browser to keep as a spare, minimised so that it can't cover or take focus from the browser in use
+def launch_spare_browser(mobile):
+    driver = launch_browser(mobile)
+    driver.minimize_window()
+    return driver
+
+
+# Restore a spare browser's window when it is handed over
+def show_browser(driver, mobile):
+    if mobile:
+        driver.set_window_rect(0, 0, mobile_width, mobile_height + 150)
+    else:
+        driver.maximize_window()
+
+
+# Start a spare browser for the platform in the background, if there isn't one already
+# Only call this between sites, never during a timing test, as launching chrome may still briefly take focus
+def warm_browser(mobile):
+    if use_browser_pool and mobile not in browser_pool:
+        browser_pool[mobile] = browser_pool_executor.submit(launch_spare_browser, mobile)
+
+
+# Take the spare browser for the platform, or launch one if there is no (working) spare
+def take_pooled_browser(mobile):
+    spare = browser_pool.pop(mobile, None)
+    if spare is not None:
+        try:
+            driver = spare.result()
+            if browser_is_alive(driver):
+                show_browser(driver, mobile)
+                return driver
+        except:
+            # Spare failed to launch; launch a new one below
+            pass
+    return launch_browser(mobile)
+
+
+# Switch the current browser to a mobile or desktop instance, handing over a warm one from the pool where possible
+# (see warm_browser)
+def switch_browser(mobile):
+    global browser, using_mobile
+    previous = browser
+    if not use_browser_pool:
+        close_browser()
+        browser = launch_browser(mobile)
+    else:
+        browser = take_pooled_browser(mobile)
+        # Sites are visited desktop first, then mobile, so the previous instance is never switched back to
+        if previous is not None:
+            try:
+                previous.quit()
+            except:
+                pass
+    using_mobile = mobile
     return browser
 
 
+# Make a mobile browser
+def mobile_browser():
+    return switch_browser(True)
+
+
 # Make a desktop browser
 def desktop_browser():
-    global browser, using_mobile
+    return switch_browser(False)
+
+
+# Quit the current browser and all spares in the pool
+def close_all_browsers():
     close_browser()
-    options = Options()
-    options.add_argument("start-maximized")
-    options.add_argument("--disable-blink-features=AutomationControlled")
-    options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    options.add_experimental_option('useAutomationExtension', False)
-    browser = Chrome(service=chrome_driver_service, options=options)
-    using_mobile = False
-    return browser
+    for spare in list(browser_pool.values()):
+        try:
+            spare.result().quit()
+        except:
+            pass
+    browser_pool.clear()
+    browser_pool_executor.shutdown(wait=False)
+
+
+# Load the button labels annotated in site_info.csv, used to find exit elements, as a dictionary by (url, platform)
+def load_exit_labels():
+    labels = {}
+    if not os.path.exists(site_info_filename):
+        return labels
+    with open(site_info_filename, "r") as f:
+        for row in csv.DictReader(f):
+            # Buttons hidden on load (e.g. in a side menu) can't be waited for
+            if row["Label"] != "" and row["Visible on load?"] == "Yes":
+                labels[row["URL"], row["Platform"]] = row["Label"]
+    return labels
+
+
+# Find the annotated label of a site's exit button, or None if it has not been annotated
+def exit_label(site):
+    global exit_labels
+    if exit_labels is None:
+        exit_labels = load_exit_labels()
+    return exit_labels.get((site.url, "Mobile" if site.mobile_site else "Desktop"))
+
+
+# Wait condition for the page to be ready according to a readiness policy (see page_readiness)
+class PageIsReady(object):
+    def __init__(self, readiness, label=None):
+        self._readiness = readiness
+        self._label = label
+
+    def __call__(self, driver):
+        return driver.execute_script("""
+            const [readiness, label] = arguments;
+            // Page we navigated away from (with an eager page load strategy, get may return before it is replaced),
+            // unless the navigation was within the page (only the fragment changed), which keeps the page
+            if (window.quickExitStale === location.href) return false;
+            if (readiness === 'complete') return document.readyState === 'complete';
+            if (readiness === 'interactive') return document.readyState !== 'loading';
+            // exit-element: a visible element with the exit button's label as its text or accessible name
+            if (!document.body) return false;
+            const wanted = label.trim().toLowerCase();
+            const isVisible = (el) => {
+                const rect = el.getBoundingClientRect();
+                return rect.width > 0 && rect.height > 0 && getComputedStyle(el).visibility !== 'hidden';
+            };
+            const walker = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT);
+            while (walker.nextNode()) {
+                if (walker.currentNode.nodeValue.trim().toLowerCase() === wanted &&
+                    isVisible(walker.currentNode.parentElement)) return true;
+            }
+            for (const el of document.querySelectorAll('[aria-label], [alt], [title], input[value]')) {
+                const name = el.getAttribute('aria-label') || el.getAttribute('alt') || el.getAttribute('title') ||
+                             el.getAttribute('value');
+                if (name.trim().toLowerCase() === wanted && isVisible(el)) return true;
+            }
+            return false;
+        """, self._readiness, self._label or "")
+
+
+# Get a page and wait for it to be ready
+# readiness overrides page_readiness; label is the exit button's label, needed for the exit-element policy
+def load_page(url, readiness=None, label=None):
+    readiness = readiness or page_readiness
+    if readiness == "exit-element" and label is None:
+        # Nothing to look for; wait for the full page instead
+        readiness = "complete"
+    start = time_ns()
+    if page_load_strategies[page_readiness] != "normal":
+        # get may return before the new page replaces this one, so mark this page as stale while it has its current URL
+        # (a same-document navigation keeps the marker, but changes the URL). A URL with a fragment that is already
+        # loaded doesn't change the page or its URL, so isn't marked
+        browser.execute_script("""
+            const target = new URL(arguments[0], location.href);
+            if (!(target.hash && target.href === location.href)) window.quickExitStale = location.href;
+        """, url)
+    from_snapshot = snapshot_store is not None and snapshot_store.open(browser, url, using_mobile)
+    if not from_snapshot:
+        browser.get(url)
+    # With the "none" page load strategy, the page can be replaced mid-script while polling, so ignore script errors
+    if readiness == "exit-element":
+        try:
+            _ = WebDriverWait(browser, exit_element_timeout, ignored_exceptions=[JavascriptException]).until(
+                PageIsReady(readiness, label))
+        except TimeoutException:
+            readiness = "complete"
+    if readiness != "exit-element":
+        _ = WebDriverWait(browser, 36000, ignored_exceptions=[JavascriptException]).until(PageIsReady(readiness))
+    if snapshot_store is not None and not from_snapshot:
+        snapshot_store.record(browser, url, using_mobile)
+    stats = page_load_stats()
+    stats["readiness"] = readiness
+    stats["snapshot"] = from_snapshot
+    stats["load_time"] = (time_ns() - start) / 10**9
+    page_loads.append(stats)
+    readiness_load_times[readiness].append(stats["load_time"])
+
+
+# Read how many of the current page's resources came from the HTTP cache
+def page_load_stats():
+    return browser.execute_script("""
+        // Cross-origin resources without timing info report zero sizes, so only count those with a known size
+        const resources = performance.getEntriesByType('resource').filter(r => r.decodedBodySize > 0);
+        return {
+            url: location.href,
+            cached: resources.filter(r => r.transferSize === 0).length,
+            resources: resources.length,
+        };
+    """)
+
+
+# Print the mean time load_page took for each readiness policy used
+def print_readiness_load_times():
+    for readiness, load_times in readiness_load_times.items():
+        print(f"{readiness}: {len(load_times)} page loads, mean {sum(load_times) / len(load_times):.2f}s, "
+              f"max {max(load_times):.2f}s")
+
+
+# Open the site in a separate, minimised window, warming the DNS, connection and HTTP caches for its next load
+# It has to be a top level page in the evaluator's browser for its cache entries to be reused (the HTTP cache is
+# partitioned by top level site), but it must never be visible, or the evaluator could see the next site before its
+# learnability test. So it isn't opened as a tab in the evaluator's window, and its window is kept minimised
+# Returns the id of the page, or None if it could not be opened
+def prefetch_site(site):
+    try:
+        target_id = browser.execute_cdp_cmd("Target.createTarget", {
+            "url": site.url, "newWindow": True, "background": True, "windowState": "minimized"})["targetId"]
+    except WebDriverException:
+        return None
+    try:
+        # In case this version of chrome ignores windowState
+        window_id = browser.execute_cdp_cmd("Browser.getWindowForTarget", {"targetId": target_id})["windowId"]
+        browser.execute_cdp_cmd("Browser.setWindowBounds", {"windowId": window_id,
+                                                             "bounds": {"windowState": "minimized"}})
+    except WebDriverException:
+        # Can't be sure it's hidden, so don't prefetch
+        close_prefetch(target_id)
+        return None
+    return target_id
+
+
+# Close a window opened by prefetch_site
+def close_prefetch(target_id):
+    try:
+        browser.execute_cdp_cmd("Target.closeTarget", {"targetId": target_id})
+    except WebDriverException:
+        # Already closed (e.g. by the evaluator)
+        pass
 
 
-# Get a page and wait for it to load
-def load_page(url):
-    browser.get(url)
-    _ = WebDriverWait(browser, 36000).until(
-        lambda d: d.execute_script("return document.readyState") == "complete"
-    )
+# Log how long the first load of a site took, and how that compares for prefetched and non-prefetched sites
+def log_prefetch(site, prefetched, stats):
+    prefetch_load_times[prefetched].append(stats["load_time"])
+    if prefetched:
+        prefetch_hits.append(stats["cached"] / stats["resources"] if stats["resources"] else 0.0)
+    message = f'First load of {site.url}: {stats["load_time"]:.2f}s, ' \
+              f'{stats["cached"]}/{stats["resources"]} resources cached ({"prefetched" if prefetched else "cold"})'
+    if prefetch_load_times[True] and prefetch_load_times[False]:
+        prefetched_mean = sum(prefetch_load_times[True]) / len(prefetch_load_times[True])
+        cold_mean = sum(prefetch_load_times[False]) / len(prefetch_load_times[False])
+        message += f' | mean hit rate {sum(prefetch_hits) / len(prefetch_hits):.0%}, ' \
+                   f'mean time saved {cold_mean - prefetched_mean:.2f}s per site'
+    print(message)
 
 
 # Show an alert and wait for it to be closed
@@ -254,64 +600,175 @@ def alert(text):
     _ = WebDriverWait(browser, 36000).until(AlertIsNotPresent())
 
 
-# Listen for sequence of keypresses
-def listen_for(keys):
-    wait_for = keys.split("+")
-    history = []
-    while history[-len(wait_for):] != wait_for:
-        history.append(keyboard.read_key())
+# Show an alert for a timing test and wait for it to be closed
+# The page records (to the console, which survives navigation) when the alert is dismissed and when the user clicks or
+# presses a key; these are read back with read_page_timings once the test is over
+def timing_alert(text):
+    browser.execute_script("""
+        const stamp = (label) => console.info('quick-exit-timing', label, performance.timeOrigin + performance.now());
+        document.addEventListener('click', () => stamp('input'), true);
+        document.addEventListener('keydown', () => stamp('input'), true);
+        setTimeout(() => { alert('""" + text + """'); stamp('alert-closed'); }, 0);
+    """)
+    # Wait for alert to open, then to be closed
+    _ = WebDriverWait(browser, 10).until(EC.alert_is_present())
+    _ = WebDriverWait(browser, 36000).until(AlertIsNotPresent())
+
+
+# Read back the times recorded by timing_alert, as (alert closed, last input) in milliseconds, or None if incomplete
+def read_page_timings():
+    alert_closed, last_input = None, None
+    for entry in browser.get_log("browser"):
+        match = re.search(r'"quick-exit-timing" "([a-z-]+)" ([0-9.]+)', entry["message"])
+        if match is None:
+            continue
+        if match.group(1) == "alert-closed":
+            alert_closed, last_input = float(match.group(2)), None
+        elif alert_closed is not None:
+            last_input = float(match.group(2))
+    if alert_closed is None or last_input is None:
+        return None
+    return alert_closed, last_input
+
+
+# Save the timing for a test under key, using the method given by timing_mode (or the closest available), and how much
+# longer each other method measured as the overhead of that method
+# With the default "python" method, saved times include the latency of polling WebDriver for the navigation (up to
+# WebDriverWait's poll interval); the difference from the "events" timing, saved with the overheads, shows how much
+# that added to each result
+def save_timing(res, key, timings):
+    methods = timing_methods[timing_methods.index(timing_mode):] + timing_methods[:timing_methods.index(timing_mode)]
+    method = next(m for m in methods if m in timings)
+    res[key] = timings[method]
+    res[key + "_method"] = method
+    overheads = {m: timings[m] - timings[method] for m in timings if m != method}
+    if overheads:
+        res[key + "_overhead"] = overheads
+
+
+# Parse a shortcut from the site list (e.g. "esc+esc") into the sequence of key names to press
+def parse_shortcut(keys):
+    return [key.strip().lower() for key in keys.split("+")]
+
+
+# Listens in the background (on the keyboard hook thread) for a sequence of keypresses, recording when the keystroke
+# completing it was pressed (in ns, on the same clock as time_ns)
+class ShortcutListener(object):
+    def __init__(self, keys):
+        self.keys = parse_shortcut(keys)
+        # Only the last len(keys) presses can complete the shortcut
+        self._recent = deque(maxlen=len(self.keys))
+        self.pressed = threading.Event()
+        self.timestamp = None
+        self._hook = None
+
+    def _on_key(self, event):
+        if event.event_type != "down" or self.pressed.is_set():
+            return
+        self._recent.append((event.name or "").lower())
+        if len(self._recent) == len(self.keys) and list(self._recent) == self.keys:
+            self.timestamp = int(event.time * 10**9)
+            self.pressed.set()
+
+    def start(self):
+        import keyboard
+        self._hook = keyboard.hook(self._on_key)
+        return self
+
+    def stop(self):
+        import keyboard
+        if self._hook is not None:
+            keyboard.unhook(self._hook)
+            self._hook = None
+
+
+# Listen for sequence of keypresses, returning when the last key was pressed
+def listen_for(keys, timeout=None):
+    listener = ShortcutListener(keys).start()
+    try:
+        listener.pressed.wait(timeout)
+    finally:
+        listener.stop()
+    return listener.timestamp
 
 
 # Wait for page to change to a different domain
-def run_exit_test(site, alert_msg):
+# Returns the time taken as measured by each available timing method
+# If shortcut is given, also listens for the shortcut being typed
+def run_exit_test(site, alert_msg, readiness=None, shortcut=None):
     global browser
-    load_page(site.url)
-    alert(alert_msg)
+    load_page(site.url, readiness, exit_label(site))
+    # Discard page load events so that only events from this test are read back
+    navigated_away = NavigatedAwayFrom(site.url)
+    navigated_away.drain(browser)
+    _ = browser.get_log("browser")
+    timing_alert(alert_msg)
     start = time_ns()
     end = start
+    timings = {}
+    listener = None
+    if shortcut is not None:
+        try:
+            listener = ShortcutListener(shortcut).start()
+        except Exception:
+            # keyboard not installed, or not permitted to hook the keyboard (needs root on linux)
+            listener = None
     try:
-        _ = WebDriverWait(browser, 36000).until(
-            lambda d: site.url not in d.current_url and
-                      site.url.replace("www.","") not in d.current_url and
-                      site.url.replace("://","://www.") not in d.current_url and
-                      site.url.replace("www.","").replace("http://","https://") not in d.current_url and
-                      site.url.replace("http://","https://www.") not in d.current_url and
-                      site.url.replace("www.","").replace("https://","http://") not in d.current_url and
-                      site.url.replace("https://","http://www.") not in d.current_url
-        )
+        _ = WebDriverWait(browser, 36000).until(navigated_away)
         end = time_ns()
+        if listener is not None and listener.pressed.is_set():
+            timings["keyboard"] = (listener.timestamp - start) / 10**9
+        if navigated_away.dialog_closed is not None:
+            # Browser-side event times, so that polling latency is not included in the timing
+            timings["events"] = (navigated_away.navigated - navigated_away.dialog_closed) / 10**3
+        page_timings = read_page_timings()
+        if page_timings is not None:
+            timings["browser"] = (page_timings[1] - page_timings[0]) / 10**3
     except KeyboardInterrupt:
         end = start - 1.0
+        timings = {}
     except:
         end = time_ns()
     finally:
+        if listener is not None:
+            listener.stop()
         cleanup_browser()
-        return (end - start) / (10 ** 9)
+        timings["python"] = (end - start) / (10 ** 9)
+        return timings
 
 
 # Wait for specific page to be loaded
-def run_explainer_test(site, alert_msg):
+# Returns the time taken as measured by each available timing method
+def run_explainer_test(site, alert_msg, readiness=None):
     global browser
-    load_page(site.url)
-    alert(alert_msg)
+    load_page(site.url, readiness, exit_label(site))
+    _ = browser.get_log("browser")
+    timing_alert(alert_msg)
     start = time_ns()
     end = start
+    timings = {}
     try:
         _ = WebDriverWait(browser, 36000).until(
             AnyTabContainsSafeBrowsingUrl(site)
         )
         end = time_ns()
+        page_timings = read_page_timings()
+        if page_timings is not None:
+            timings["browser"] = (page_timings[1] - page_timings[0]) / 10**3
     except KeyboardInterrupt:
         end = start - 1.0
+        timings = {}
     except:
         end = time_ns()
     finally:
         cleanup_browser()
-        return (end - start) / (10 ** 9)
+        timings["python"] = (end - start) / (10 ** 9)
+        return timings
 
 
 # Evaluate a single website
-def evaluate_website(site):
+# If next_site is given, it is prefetched while the evaluator fills in the survey
+def evaluate_website(site, next_site=None):
     global browser, evaluator_name
     res = {
         "url": site.url,
@@ -322,20 +779,30 @@ def evaluate_website(site):
         mobile_browser()
     elif not site.mobile_site and using_mobile:
         desktop_browser()
+    # Record stats for page loads, so the first load of the site can be logged
+    del page_loads[:]
 
     # RUN TIMING TESTS
     # Button click test
     if site.has_button():
-        res["learn_button_time"] = run_exit_test(site, 'Please find and click the quick exit button')
+        save_timing(res, "learn_button_time",
+                    run_exit_test(site, 'Please find and click the quick exit button'))
     # Shortcut tests
     if site.has_shortcut():
-        res["learn_shortcut_time"] = run_exit_test(site, 'Please find and type the quick exit keyboard shortcut')
+        save_timing(res, "learn_shortcut_time",
+                    run_exit_test(site, 'Please find and type the quick exit keyboard shortcut',
+                                  shortcut=site.shortcut))
     # Locate explainer text
     if site.has_safe_browsing_page():
-        res["learn_explainer_time"] = run_explainer_test(site, 'Please find and go to the safe browsing information page')
+        save_timing(res, "learn_explainer_time",
+                    run_explainer_test(site, 'Please find and go to the safe browsing information page'))
+
+    # Log the first load of the site (loaded in the first timing test)
+    if page_loads:
+        log_prefetch(site, site.url in prefetched_urls, page_loads[0])
 
     # Reset site for evaluator to view
-    load_page(site.url)
+    load_page(site.url, label=exit_label(site))
     # Load site evaluation survey
     browser.execute_script(f"window.open('{survey_url}');")
     sleep(0.5)
@@ -377,6 +844,12 @@ def evaluate_website(site):
         browser.find_element(By.ID, value='QID11-6-label').click()
     # Scroll back to the top
     browser.execute_script('window.scrollTo(0, 0);')
+    # Warm the caches for the next site while the evaluator fills in the survey
+    prefetch_tab = None
+    if use_prefetch and next_site is not None:
+        prefetch_tab = prefetch_site(next_site)
+        if prefetch_tab is not None:
+            prefetched_urls.add(next_site.url)
     # Wait for page submit
     try:
         _ = WebDriverWait(browser, 36000).until(
@@ -387,18 +860,24 @@ def evaluate_website(site):
         raise e
 
     # Close survey and any extra tabs
+    if prefetch_tab is not None:
+        close_prefetch(prefetch_tab)
     cleanup_browser()
 
     # RUN MEMORABILITY TIMING TESTS
     # Button click test
     if site.has_button():
-        res["recall_button_time"] = run_exit_test(site, 'Please find and click the quick exit button')
+        save_timing(res, "recall_button_time",
+                    run_exit_test(site, 'Please find and click the quick exit button'))
     # Shortcut tests
     if site.has_shortcut():
-        res["recall_shortcut_time"] = run_exit_test(site, 'Please find and type the quick exit keyboard shortcut')
+        save_timing(res, "recall_shortcut_time",
+                    run_exit_test(site, 'Please find and type the quick exit keyboard shortcut',
+                                  shortcut=site.shortcut))
     # Locate explainer text
     if site.has_safe_browsing_page():
-        res["recall_explainer_time"] = run_explainer_test(site, 'Please find and go to the safe browsing information page')
+        save_timing(res, "recall_explainer_time",
+                    run_explainer_test(site, 'Please find and go to the safe browsing information page'))
 
     # Return results for this site
     return res
@@ -411,11 +890,7 @@ def evaluate_all():
     evaluator_name, evaluated = load_state()
     for completed_site in evaluated:
         mobile = completed_site["is_mobile"]
-        cs = Site(completed_site["url"], mobile)
-        if not mobile and cs in desktop_site_list:
-            desktop_site_list.remove(cs)
-        elif mobile and cs in mobile_site_list:
-            mobile_site_list.remove(cs)
+        (mobile_site_list if mobile else desktop_site_list).discard((completed_site["url"], mobile))
     print(f"You have {len(desktop_site_list)} desktop sites and {len(mobile_site_list)} mobile sites remaining.")
 
     if "" == evaluator_name:
@@ -424,16 +899,20 @@ def evaluate_all():
         evaluated = []
 
     # Randomise order of sites to evaluate
-    random.shuffle(desktop_site_list)
-    random.shuffle(mobile_site_list)
+    desktop_site_list.shuffle()
+    mobile_site_list.shuffle()
 
     # Run desktop site tests
     if 0 != len(desktop_site_list):
         desktop_browser()
-        for site in desktop_site_list:
-            res = evaluate_website(site)
+        sites = list(desktop_site_list)
+        for i, site in enumerate(sites):
+            res = evaluate_website(site, sites[i+1] if i+1 < len(sites) else None)
             evaluated.append(res)
-            save_state(evaluator_name, evaluated)
+            save_result(evaluator_name, res)
+            if i+1 == len(sites) and 0 != len(mobile_site_list):
+                # Between timing tests, so a spare mobile browser can start without disturbing them
+                warm_browser(True)
             # Clear site and allow pause / exit
             try:
                 cleanup_browser()
@@ -448,10 +927,11 @@ def evaluate_all():
     # Run mobile site tests
     if 0 != len(mobile_site_list):
         mobile_browser()
-        for site in mobile_site_list:
-            res = evaluate_website(site)
+        sites = list(mobile_site_list)
+        for i, site in enumerate(sites):
+            res = evaluate_website(site, sites[i+1] if i+1 < len(sites) else None)
             evaluated.append(res)
-            save_state(evaluator_name, evaluated)
+            save_result(evaluator_name, res)
             # Clear site and allow pause / exit
             try:
                 cleanup_browser()
@@ -468,6 +948,11 @@ def evaluate_all():
 
 
 if __name__ == '__main__':
+    if "--compact" in sys.argv:
+        # Only fold saved results into evaluation.json
+        compact_state()
+        print(f"Results compacted into {state_filename}.")
+        sys.exit(0)
     print("""Welcome to the quick exit button evaluator!
 
 You will be asked to locate the quick exit buttons (and where applicable, exit shortcuts and safe browsing information) 
@@ -491,4 +976,7 @@ take a break, or to close the browser and save your progress for later.
     # print("\n".join(map(str, desktop_site_list)), "\n------------\n", "\n".join(map(str, mobile_site_list)))
     print(f"{len(desktop_site_list)} desktop sites and {len(mobile_site_list)} mobile sites loaded.")
     evaluate_all()
-    close_browser()
+    close_all_browsers()
+    print_readiness_load_times()
+    # Fold this session's results into evaluation.json, ready to be sent
+    compact_state()
@@ -1,30 +1,39 @@
 # Importing libraries
-import csv
+import hashlib
 import json
+import os
+import pickle
+import time
+import warnings
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from sklearn.feature_selection import RFE
 from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import roc_auc_score
 import statsmodels.api as sm
 from math import e, exp, log
-from sys import exit
+from sys import argv, exit
 from scipy.spatial import KDTree
 from webcolors import (
     CSS3_HEX_TO_NAMES,
     hex_to_rgb,
 )
-from agreement import load_survey_data
+from agreement import load_survey_table, questions, survey_filename
 
 def compute_logreg_stats(coef, std_err):
     o, l, h = pow(e, coef), pow(e, coef - (1.96 * std_err)), pow(e, coef + (1.96 * std_err))
     return f"{o:.3f} & {l:.3f} & {h:.3f} \\"
 
+# Timing test results from each annotator (filenames temporarily blinded)
+timing_filenames = ['evaluation1.json', 'evaluation2.json']
+
 # Load timing test results, computing mean time taken for each test
 def load_timing_data():
     responses = {}
-    # Filenames temporarily blinded
-    for filename in ['evaluation1.json', 'evaluation2.json']:
+    for filename in timing_filenames:
         with open(filename, 'r') as annotations_file:
             parsed_json = json.load(annotations_file)
             # name = parsed_json['name']
@@ -44,21 +53,26 @@ def load_timing_data():
                             responses[(url, platform)][test] = site[test]
     return responses
 
+# Index of all css3 colours and their names, built once for nearest-colour lookups
+css3_colour_names = list(CSS3_HEX_TO_NAMES.values())
+css3_colour_tree = KDTree([hex_to_rgb(colour_hex) for colour_hex in CSS3_HEX_TO_NAMES])
+# Cache of colour names for hex codes already looked up
+colour_name_cache = {'Transparent': 'Transparent'}
+
 def convert_rgb_to_names(rgb_hex):
-    if rgb_hex == 'Transparent':
-        return 'Transparent'
-    rgb_tuple = hex_to_rgb(rgb_hex)
-    # a dictionary of all the hex and their respective names in css3
-    css3_db = CSS3_HEX_TO_NAMES
-    names = []
-    rgb_values = []
-    for color_hex, color_name in css3_db.items():
-        names.append(color_name)
-        rgb_values.append(hex_to_rgb(color_hex))
-
-    kdt_db = KDTree(rgb_values)
-    distance, index = kdt_db.query(rgb_tuple)
-    return names[index]
+    if rgb_hex not in colour_name_cache:
+        distance, index = css3_colour_tree.query(hex_to_rgb(rgb_hex))
+        colour_name_cache[rgb_hex] = css3_colour_names[index]
+    return colour_name_cache[rgb_hex]
+
+# Convert a whole column of hex codes to colour names, looking up all new colours in a single query
+def convert_rgb_column_to_names(rgb_hexes):
+    new_hexes = list(set(rgb_hex for rgb_hex in rgb_hexes if rgb_hex not in colour_name_cache))
+    if new_hexes:
+        distances, indices = css3_colour_tree.query([hex_to_rgb(rgb_hex) for rgb_hex in new_hexes])
+        for rgb_hex, index in zip(new_hexes, indices):
+            colour_name_cache[rgb_hex] = css3_colour_names[index]
+    return [colour_name_cache[rgb_hex] for rgb_hex in rgb_hexes]
 
 def likert_to_number(hr_score):
     if hr_score == 'Strongly agree':
@@ -73,125 +87,308 @@ def likert_to_number(hr_score):
         # Both neither agree nor disagree and error case
         return 0
 
+# Categorical site properties in site_info.csv, each one-hot encoded as a boolean column for each possible value
+one_hot_features = [
+    ('Size', {'Size_text': 'text', 'Size_small': 'small', 'Size_average': 'average', 'Size_wide': 'wide',
+              'Size_long': 'long', 'Size_large': 'large'}),
+    ('Location', {'Location_top_left': 'top left', 'Location_top': 'top', 'Location_top_right': 'top right',
+                  'Location_left': 'left', 'Location_content': 'content', 'Location_right': 'right',
+                  'Location_bottom_left': 'bottom left', 'Location_bottom': 'bottom',
+                  'Location_bottom_right': 'bottom right', 'Location_dropdown': 'dropdown',
+                  'Location_menu': 'side menu'}),
+    ('Type', {'Type_button': 'button', 'Type_banner': 'banner', 'Type_image_icon': 'image',
+              'Type_menu_item': 'menu item', 'Type_text': 'text'}),
+    ('Visible on load?', {'Visible_yes': 'Yes', 'Visible_covered': 'Cookie Notice', 'Visible_no': 'No'}),
+]
+timing_questions = ['learn_button_time', 'recall_button_time', 'learn_shortcut_time', 'recall_shortcut_time',
+                    'learn_explainer_time', 'recall_explainer_time']
+# Columns of the combined dataset, in order: site info, then average likert answers, then average timings
+site_columns = ['URL', 'Platform', 'Colour', 'Background Colour'] + list(one_hot_features[0][1]) + \
+               list(one_hot_features[1][1]) + list(one_hot_features[2][1]) + ['Sticky'] + \
+               list(one_hot_features[3][1]) + ['Labelled', 'Single_click']
+data_columns = site_columns + questions + timing_questions
+
+# Combined dataset is cached here, along with hashes of the files it was built from
+feature_cache_filename = "logistic_regression_info.npz"
+
+def file_digest(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+# Site info columns for each row of site_info.csv (as strings)
+def site_features(site_info):
+    features = {
+        'URL': site_info['URL'].to_numpy(str), 'Platform': site_info['Platform'].to_numpy(str),
+        # Convert colours to human names and group
+        'Colour': np.array(convert_rgb_column_to_names(list(site_info['Colour'])), dtype=str),
+        'Background Colour': np.array(convert_rgb_column_to_names(list(site_info['Background Colour'])), dtype=str),
+    }
+    # For each property, make a boolean variable for each possible result
+    one_hot = {}
+    for column, values in one_hot_features:
+        matches = site_info[column].to_numpy(str)[:, None] == np.array(list(values.values()))
+        one_hot.update(zip(values, matches.T))
+    features.update(one_hot)
+    features['Sticky'] = site_info['Sticky?'].to_numpy(str) == 'True'
+    # Make labelling boolean
+    features['Labelled'] = site_info['Label'].to_numpy(str) != ''
+    # Clicks required is 1 or 2, so treat as boolean (is single click)
+    features['Single_click'] = site_info['Clicks Required'].to_numpy(str) == '1'
+    return features
+
+# Average answer to each likert question (from -2 to 2) for each (url, platform), or 0 if the site wasn't surveyed
+def likert_features(keys):
+    table = load_survey_table()
+    answers = np.frombuffer(table.answers, dtype=np.int8).reshape(len(table), len(questions))
+    site_codes = np.frombuffer(table.site_codes, dtype=np.uint16)
+    # Answers are coded as their index from strongly disagree (0) to strongly agree (4); unanswered questions count as 0
+    scores = np.where(answers >= 0, answers - 2, 0)
+    totals = np.zeros((len(table.sites), len(questions)))
+    np.add.at(totals, site_codes, scores)
+    means = totals / np.maximum(np.bincount(site_codes, minlength=len(table.sites)), 1)[:, None]
+    site_index = {site: i for i, site in enumerate(table.sites)}
+    codes = np.array([site_index.get(key, -1) for key in keys], dtype=int)
+    means = np.vstack([means, np.zeros(len(questions))])
+    return dict(zip(questions, means[codes].T))
+
+# Average time taken for each timing test for each (url, platform), or 0 if the test wasn't done
+def timing_features(keys):
+    timings = load_timing_data()
+    return {t: np.array([timings.get(key, {}).get(t, 0) for key in keys], dtype=float) for t in timing_questions}
+
 # Combine both sets of annotations with site data to get dataset of all information about sites
-def combine_data():
+# The dataset is cached, and only rebuilt when site_info.csv, the survey or the timing results change; if only some
+# rows of site_info.csv changed, only those rows' site info is recomputed
+# If export is set, the dataset is also saved as logistic_regression_info.csv
+def combine_data(export=False):
     destination_filename = "logistic_regression_info.csv"
+    sources = np.array([file_digest(filename) for filename in ["site_info.csv", survey_filename] + timing_filenames])
 
-    # Load likert scale annotations
-    likerts = load_survey_data()
-    # Load timing annotations
-    timings = load_timing_data()
+    cache = None
+    if os.path.exists(feature_cache_filename):
+        try:
+            with np.load(feature_cache_filename, allow_pickle=False) as f:
+                cache = {column: f[column] for column in f.files}
+        except (OSError, ValueError, zipfile.BadZipFile):
+            cache = None
+        if cache is not None and not set(data_columns).issubset(cache):
+            cache = None
 
-    # Load site data and combine data for each site
-    with open(destination_filename, 'w', newline='') as df:
-        df.write("URL,Platform,"+#Colour,Background Colour,
-                 "Size_text,Size_small,Size_average,Size_wide,Size_long,Size_large,"+
-                 "Location_top_left,Location_top,Location_top_right,Location_left,Location_content,Location_right,"+
-                 "Location_bottom_left,Location_bottom,Location_bottom_right,Location_dropdown,Location_menu,"+
-                 "Type_button,Type_banner,Type_image_icon,Type_menu_item,Type_text,"+
-                 "Sticky,Visible_yes,Visible_covered,Visible_no,Labelled,Single_click,"+#Keys,
-                 "button-discover,button-distinct,shortcut-discover,shortcut-intuitive,text-discover,text-comprehend,"+
-                 "safety-discover,learn_button_time,recall_button_time,learn_shortcut_time,recall_shortcut_time,"+
-                 "learn_explainer_time,recall_explainer_time\n"
-                 )
-        df_writer = csv.writer(df, delimiter=',', quoting=csv.QUOTE_MINIMAL)
-        with open("site_info.csv", "r") as f:
-            r = csv.DictReader(f)
-            for row in r:
-                # Format: URL, platform, [sitedata], [likerts], [timings]
-                record = [
-                    # Site info
-                    row['URL'], row['Platform'],
-                    # Convert colours to human names and group
-                    #convert_rgb_to_names(row['Colour']),
-                    #convert_rgb_to_names(row['Background Colour']),
-                ]
-                # For each property, make a boolean variable for each possible result
-                for size in ['text', 'small', 'average', 'wide', 'long', 'large']:
-                    record.append(size == row['Size'])
-                for loc in ['top left', 'top', 'top right', 'left', 'content', 'right', 'bottom left', 'bottom',
-                            'bottom right', 'dropdown', 'side menu']:
-                    record.append(loc == row['Location'])
-                for t in ['button', 'banner', 'image', 'menu item', 'text']:
-                    record.append(t == row['Type'])
-                # Already boolean
-                record.append(row['Sticky?'])
-                for v in ['Yes', 'Cookie Notice', 'No']:
-                    record.append(v == row['Visible on load?'])
-                # Make labelling boolean
-                record.append(row['Label'] != '')
-                # Clicks required is 1 or 2, so treat as boolean (is single click)
-                record.append(row['Clicks Required'] == '1')
-
-                # Compute average for each likert scale as value from -2 to 2
-                likert_qs = ['button-discover','button-distinct','shortcut-discover','shortcut-intuitive',
-                             'text-discover', 'text-comprehend', 'safety-discover']
-                for l in likert_qs:
-                    if (row['URL'], row['Platform']) in likerts:
-                        n,v = 0, 0
-                        for r in likerts[row['URL'], row['Platform']]:
-                            if l in r:
-                                v += likert_to_number(r[l])
-                                n += 1
-                        record.append(v / max(n, 1))
-                    else:
-                        record.append(0)
-                # Compute average timings for site
-                timing_qs = ['learn_button_time', 'recall_button_time', 'learn_shortcut_time', 'recall_shortcut_time',
-                           'learn_explainer_time', 'recall_explainer_time']
-                # Compute combined record for each site
-                for t in timing_qs:
-                    if (row['URL'], row['Platform']) in timings and t in timings[row['URL'], row['Platform']]:
-                        record.append(timings[row['URL'], row['Platform']][t])
-                    else:
-                        record.append(0)
-                # Save to file
-                df_writer.writerow(record)
+    if cache is not None and np.array_equal(cache['sources'], sources):
+        data = pd.DataFrame({column: cache[column] for column in data_columns})
+    else:
+        site_info = pd.read_csv("site_info.csv", dtype=str, keep_default_na=False)
+        row_hashes = pd.util.hash_pandas_object(site_info, index=False).to_numpy()
+        features = {}
+        if cache is not None and len(cache['row_hashes']):
+            # Reuse site info of rows that haven't changed, and only compute it for new/changed rows
+            # (site_info.csv may have duplicate rows, so match each row to the first cached row with the same hash)
+            unique_hashes, first_rows = np.unique(cache['row_hashes'], return_index=True)
+            positions = np.minimum(np.searchsorted(unique_hashes, row_hashes), len(unique_hashes) - 1)
+            cached_rows = np.where(unique_hashes[positions] == row_hashes, first_rows[positions], -1)
+            changed = np.flatnonzero(cached_rows < 0)
+            new_features = site_features(site_info.iloc[changed])
+            for column in site_columns:
+                values = cache[column][np.maximum(cached_rows, 0)]
+                if len(changed):
+                    # Widen string columns if any new value is longer
+                    values = values.astype(np.result_type(values, new_features[column]))
+                    values[changed] = new_features[column]
+                features[column] = values
+        else:
+            features = site_features(site_info)
+        keys = list(zip(site_info['URL'], site_info['Platform']))
+        features.update(likert_features(keys))
+        features.update(timing_features(keys))
+        data = pd.DataFrame({column: features[column] for column in data_columns})
+
+        tmp_filename = feature_cache_filename + ".tmp"
+        with open(tmp_filename, 'wb') as f:
+            np.savez(f, sources=sources, row_hashes=row_hashes, **features)
+        os.replace(tmp_filename, feature_cache_filename)
+
+    if export:
+        data.to_csv(destination_filename, index=False)
+    return data
+
+# Site properties used as factors in the regressions
+x_cols = [
+    "Size_text","Size_small","Size_average","Size_wide","Size_long","Size_large",
+    "Location_top_left","Location_top","Location_top_right","Location_left","Location_content","Location_right","Location_bottom_left","Location_bottom","Location_bottom_right","Location_menu", #,"Location_dropdown" - only 1 site
+    "Type_button","Type_banner","Type_image_icon","Type_menu_item","Type_text",
+    "Sticky","Labelled","Single_click",
+    "Visible_yes","Visible_covered","Visible_no",
+]
+# Outcomes to fit a regression for
+y_cols = [
+    "button-discover","button-distinct","learn_button_time","recall_button_time",
+]
+# Further outcomes, fitted with --all
+extra_y_cols = [
+    "shortcut-discover","shortcut-intuitive","learn_shortcut_time","recall_shortcut_time",
+    "text-discover","text-comprehend",
+    "safety-discover","learn_explainer_time","recall_explainer_time",
+]
+# Factors left out of the regression for each outcome
+excluded_x_cols = {
+    "button-distinct": ["Location_menu", "Type_menu_item", "Location_content", "Size_large"],
+    "learn_button_time": ["Location_menu", "Type_menu_item", "Location_content", "Size_large",
+                          "Size_small", "Location_bottom_left"],
+    "recall_button_time": ["Location_menu", "Type_menu_item", "Location_content", "Size_large",
+                           "Size_small", "Location_bottom_left"],
+}
+
+# Fitted regressions are cached here by data hash, outcome and factors
+fit_cache_filename = "logistic_regression_fits.pickle"
+
+def outcome_x_cols(ycol):
+    return [x for x in x_cols if x not in excluded_x_cols.get(ycol, [])]
+
+def data_digest(data):
+    return hashlib.sha256(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes()).hexdigest()
+
+# Binarise an outcome: timings as whether the test took under threshold seconds, likerts as whether the average answer
+# was above threshold
+def outcome_labels(data, ycol, threshold=None):
+    if "time" in ycol:
+        # Timing test
+        return data[ycol] < (10 if threshold is None else threshold)
+    else:
+        # Likert
+        return data[ycol] > (0 if threshold is None else threshold)
+
+# Pick out the best factors for an outcome with RFE, then fit a logit model on them
+# Returns the chosen factors, the model summary, and its likelihood ratio chi2 and p value
+# Raises ValueError if every site has the same outcome, as there is nothing to fit
+def fit_outcome(data, ycol, features):
+    X = data[features]
+    y = outcome_labels(data, ycol)
+    if y.nunique() < 2:
+        raise ValueError(f"every site has the same outcome ({bool(y.iloc[0]) if len(y) else 'no sites'})")
+
+    # Pick out best factors
+    logreg = LogisticRegression()
+    rfe = RFE(logreg)
+    rfe = rfe.fit(X, y)
+    chosen = list(np.array(features)[rfe.support_])
+    X = data[chosen]
+
+    # See stats for chosen factors
+    logit_model = sm.Logit(y, X)
+    result = logit_model.fit(method='minimize', maxiter=500, disp=False)
+    return {'chosen': chosen, 'summary': str(result.summary()), 'llr': float(result.llr),
+            'llr_pvalue': float(result.llr_pvalue)}
+
+# Fit every outcome, each with its own factors, in parallel across processes (if processes > 1)
+# Fits are cached, so only outcomes whose data or factors changed are refitted
+# Returns {outcome: fit} in the order of outcomes (see fit_outcome); an outcome that can't be fitted is reported (and
+# not cached) as {'error': message}, without stopping the other outcomes
+def fit_outcomes(data, outcomes=None, processes=None):
+    outcomes = outcomes or y_cols
+    processes = processes or os.cpu_count()
+    digest = data_digest(data)
+    cache = {}
+    if os.path.exists(fit_cache_filename):
+        try:
+            with open(fit_cache_filename, "rb") as f:
+                cache = pickle.load(f)
+        except Exception:
+            # Unreadable (e.g. from an older version); fit again below
+            cache = {}
+    keys = {ycol: (digest, ycol, tuple(outcome_x_cols(ycol))) for ycol in outcomes}
+    to_fit = [ycol for ycol in outcomes if keys[ycol] not in cache]
+    errors = {}
+    if processes <= 1 or len(to_fit) <= 1:
+        for ycol in to_fit:
+            try:
+                cache[keys[ycol]] = fit_outcome(data, ycol, outcome_x_cols(ycol))
+            except Exception as e:
+                errors[ycol] = {'error': f"{type(e).__name__}: {e}"}
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(to_fit))) as executor:
+            futures = {ycol: executor.submit(fit_outcome, data, ycol, outcome_x_cols(ycol)) for ycol in to_fit}
+            for ycol, future in futures.items():
+                try:
+                    cache[keys[ycol]] = future.result()
+                except Exception as e:
+                    errors[ycol] = {'error': f"{type(e).__name__}: {e}"}
+    if len(errors) < len(to_fit):
+        try:
+            with open(fit_cache_filename + ".tmp", "wb") as f:
+                pickle.dump(cache, f)
+            os.replace(fit_cache_filename + ".tmp", fit_cache_filename)
+        except OSError:
+            # Cache is only an optimisation
+            pass
+    return {ycol: errors[ycol] if ycol in errors else cache[keys[ycol]] for ycol in outcomes}
+
+# Thresholds tried for each kind of outcome when cross validating
+timing_thresholds = [5, 10, 15, 20]
+likert_thresholds = [-1, -0.5, 0, 0.5, 1]
+
+# Cross validate RFE + Logit for an outcome over k folds, at each threshold for binarising the outcome
+# The folds (and their design matrices) are built once and shared by every threshold, and each fold's logit fit starts
+# from its fit at the previous threshold when RFE chose the same factors
+# Returns {threshold: stats} with held-out accuracy and AUC (of the pooled out-of-fold predictions), the share of
+# positive sites, and the time spent in RFE and in fitting the logit models
+def cross_validate(data, ycol, thresholds=None, k=5, seed=0):
+    thresholds = thresholds or (timing_thresholds if "time" in ycol else likert_thresholds)
+    X = data[outcome_x_cols(ycol)].to_numpy(float)
+    order = np.random.default_rng(seed).permutation(len(X))
+    folds = []
+    for test in np.array_split(order, k):
+        train = np.setdiff1d(order, test)
+        folds.append((train, test, X[train], X[test]))
+
+    start_params = {}
+    results = {}
+    for threshold in thresholds:
+        y = outcome_labels(data, ycol, threshold).to_numpy()
+        predictions = np.full(len(X), np.nan)
+        rfe_time, logit_time = 0.0, 0.0
+        for f, (train, test, X_train, X_test) in enumerate(folds):
+            if len(np.unique(y[train])) < 2:
+                # Nothing to fit
+                continue
+            with warnings.catch_warnings():
+                # Small folds often give (quasi-)separation or hit maxiter
+                warnings.simplefilter('ignore')
+                start = time.perf_counter()
+                rfe = RFE(LogisticRegression()).fit(X_train, y[train])
+                chosen = np.flatnonzero(rfe.support_)
+                rfe_time += time.perf_counter() - start
+                start = time.perf_counter()
+                result = sm.Logit(y[train], X_train[:, chosen]).fit(
+                    method='minimize', maxiter=500, disp=False, start_params=start_params.get((f, tuple(chosen))))
+                logit_time += time.perf_counter() - start
+            start_params[f, tuple(chosen)] = result.params
+            predictions[test] = result.predict(X_test[:, chosen])
+        evaluated = ~np.isnan(predictions)
+        y_evaluated, predicted = y[evaluated], predictions[evaluated]
+        results[threshold] = {
+            'accuracy': float(np.mean((predicted > 0.5) == y_evaluated)) if evaluated.any() else float('nan'),
+            'auc': float(roc_auc_score(y_evaluated, predicted)) if len(np.unique(y_evaluated)) == 2 else float('nan'),
+            'positive': float(np.mean(y)),
+            'rfe_time': rfe_time,
+            'logit_time': logit_time,
+        }
+    return results
 
 if __name__ == '__main__':
-    combine_data()
-    data = pd.read_csv("logistic_regression_info.csv")
-    # Divide the data to training set and test set
-    x_cols = [
-        "Size_text","Size_small","Size_average","Size_wide","Size_long","Size_large",
-        "Location_top_left","Location_top","Location_top_right","Location_left","Location_content","Location_right","Location_bottom_left","Location_bottom","Location_bottom_right","Location_menu", #,"Location_dropdown" - only 1 site
-        "Type_button","Type_banner","Type_image_icon","Type_menu_item","Type_text",
-        "Sticky","Labelled","Single_click",
-        "Visible_yes","Visible_covered","Visible_no",
-    ]
-    y_cols = [
-        "button-discover","button-distinct","learn_button_time","recall_button_time",
-        #"shortcut-discover","shortcut-intuitive","learn_shortcut_time","recall_shortcut_time",
-        #"text-discover","text-comprehend",
-        #"safety-discover","learn_explainer_time","recall_explainer_time"
-    ]
-    for ycol in y_cols:
-        if ycol == "button-distinct":
-            x_cols.remove("Location_menu")
-            x_cols.remove("Type_menu_item")
-            x_cols.remove("Location_content")
-            x_cols.remove("Size_large")
-        elif ycol == "learn_button_time":
-            x_cols.remove("Size_small")
-            x_cols.remove("Location_bottom_left")
-        X = data[x_cols]
+    data = combine_data(export='--export' in argv)
+    outcomes = y_cols + extra_y_cols if '--all' in argv else y_cols
+    if '--cross-validate' in argv:
+        for ycol in outcomes:
+            print(ycol)
+            for threshold, stats in cross_validate(data, ycol).items():
+                print(f"    threshold {threshold}: accuracy {stats['accuracy']:.3f}, AUC {stats['auc']:.3f} "
+                      f"({stats['positive']:.0%} positive; RFE {stats['rfe_time']:.2f}s, "
+                      f"logit {stats['logit_time']:.2f}s)")
+        exit(0)
+    for ycol, fit in fit_outcomes(data, outcomes).items():
         print(ycol)
-        if "time" in ycol:
-            # Timing test
-            y = data[ycol] < 10
-        else:
-            # Likert
-            y = data[ycol] > 0
-
-        # Pick out best factors
-        logreg = LogisticRegression()
-        rfe = RFE(logreg)
-        rfe = rfe.fit(X, y)
-        chosen = np.array(x_cols)[rfe.support_]
-        X = data[chosen]
-
-        # See stats for chosen factors
-        logit_model = sm.Logit(y, X)
-        result = logit_model.fit(method='minimize', maxiter=500)
-        print(result.summary())
-        print(f"chi2:{result.llr}, p value: {result.llr_pvalue}")
+        if 'error' in fit:
+            print(f"Not fitted: {fit['error']}")
+            continue
+        print(fit['summary'])
+        print(f"chi2:{fit['llr']}, p value: {fit['llr_pvalue']}")
@@ -0,0 +1,133 @@
+# Inter-rater agreement for any number of raters, with missing answers
+#
+# Computes Fleiss' Kappa, Krippendorff's Alpha (ordinal) and pairwise Cohen's Kappa (unweighted and weighted) for
+# every likert question, with bootstrap confidence intervals over sites
+#
+# Every statistic is a function of sums over sites, so a bootstrap resample is just a weighting of the sites (how many
+# times each was drawn); whole batches of resamples are then computed as matrix products of weights x per-site counts
+from itertools import combinations
+
+import numpy as np
+
+from agreement import load_survey_table, questions, likert_options, squashed_codes
+
+
+# Per-site counts needed for every statistic, computed once from the coded response matrix [site, rater, question]
+class SiteCounts:
+    def __init__(self, raters, matrix, squash_agree=False):
+        codes = squashed_codes[matrix] if squash_agree else matrix
+        self.raters = raters
+        self.n_categories = 3 if squash_agree else len(likert_options)
+        categories = np.arange(self.n_categories)
+        # Answers to each question by each rater, one-hot: shape (site, rater, question, category)
+        one_hot = (codes[..., None] == categories).astype(float)
+        # Number of raters giving each answer: shape (site, question, category)
+        self.counts = one_hot.sum(axis=1)
+        # Number of raters answering: shape (site, question); sites with fewer than 2 can't show (dis)agreement
+        n_rated = self.counts.sum(axis=-1)
+        self.pairable = (n_rated >= 2).astype(float)
+        self.n_rated = n_rated * self.pairable
+        self.counts = self.counts * self.pairable[..., None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Fleiss: proportion of agreeing rater pairs for each site
+            self.pair_agreement = np.where(
+                self.pairable > 0,
+                ((self.counts ** 2).sum(axis=-1) - n_rated) / (n_rated * (n_rated - 1)), 0.0)
+            # Krippendorff: coincidences of answers within each site: shape (site, question, category, category)
+            self.coincidences = np.where(
+                self.pairable[..., None, None] > 0,
+                (self.counts[..., :, None] * self.counts[..., None, :] -
+                 np.eye(self.n_categories) * self.counts[..., None]) / (n_rated - 1)[..., None, None], 0.0)
+        # Cohen: confusion of answers for each pair of raters: shape (site, question, category, category)
+        self.pairs = list(combinations(range(len(raters)), 2))
+        self.pair_confusion = [one_hot[:, a, :, :, None] * one_hot[:, b, :, None, :] for a, b in self.pairs]
+
+
+# Fleiss' Kappa of each question for a batch of site weightings: weights shape (batch, site), result (batch, question)
+# Sites with different numbers of raters are handled by using each site's own number of raters
+def fleiss_kappa(site_counts, weights):
+    n_sites = weights @ site_counts.pairable
+    p = np.einsum('bs,sqc->bqc', weights, site_counts.counts) / (weights @ site_counts.n_rated)[..., None]
+    p_agree = (weights @ site_counts.pair_agreement) / n_sites
+    p_expected = (p * p).sum(axis=-1)
+    return (p_agree - p_expected) / (1 - p_expected)
+
+
+# Krippendorff's Alpha of each question with the ordinal metric, for a batch of site weightings
+def krippendorff_alpha(site_counts, weights):
+    coincidences = np.einsum('bs,sqck->bqck', weights, site_counts.coincidences)
+    n_c = coincidences.sum(axis=-1)
+    n = n_c.sum(axis=-1)
+    # Ordinal distance between answers c and k: (number of answers from c to k, counting c and k as half) squared
+    cumulative = np.cumsum(n_c, axis=-1)
+    c, k = np.meshgrid(np.arange(site_counts.n_categories), np.arange(site_counts.n_categories), indexing='ij')
+    low, high = np.minimum(c, k), np.maximum(c, k)
+    between = cumulative[..., high] - cumulative[..., low] + n_c[..., low]
+    distance = (between - (n_c[..., c] + n_c[..., k]) / 2) ** 2
+    observed = (coincidences * distance).sum(axis=(-2, -1))
+    expected = (n_c[..., :, None] * n_c[..., None, :] * distance).sum(axis=(-2, -1))
+    return 1 - (n - 1) * observed / expected
+
+
+# Cohen's Kappa of each question for every pair of raters, for a batch of site weightings
+# If weighted, disagreements are weighted by the squared distance between answers (quadratic weighted kappa)
+def cohen_kappas(site_counts, weights, weighted=False):
+    c, k = np.meshgrid(np.arange(site_counts.n_categories), np.arange(site_counts.n_categories), indexing='ij')
+    agreement_weights = 1 - (c - k) ** 2 / (site_counts.n_categories - 1) ** 2 if weighted \
+        else np.eye(site_counts.n_categories)
+    kappas = {}
+    for (a, b), pair_confusion in zip(site_counts.pairs, site_counts.pair_confusion):
+        confusion = np.einsum('bs,sqck->bqck', weights, pair_confusion)
+        confusion = confusion / confusion.sum(axis=(-2, -1), keepdims=True)
+        expected = confusion.sum(axis=-1)[..., :, None] * confusion.sum(axis=-2)[..., None, :]
+        p_observed = (confusion * agreement_weights).sum(axis=(-2, -1))
+        p_expected = (expected * agreement_weights).sum(axis=(-2, -1))
+        kappas[site_counts.raters[a], site_counts.raters[b]] = (p_observed - p_expected) / (1 - p_expected)
+    return kappas
+
+
+# Every statistic for a batch of site weightings, as a dictionary of arrays of shape (batch, question)
+def agreement_batch(site_counts, weights):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats = {'Fleiss': fleiss_kappa(site_counts, weights),
+                 'Krippendorff': krippendorff_alpha(site_counts, weights)}
+        for pair, kappa in cohen_kappas(site_counts, weights).items():
+            stats['Cohen', pair] = kappa
+        for pair, kappa in cohen_kappas(site_counts, weights, weighted=True).items():
+            stats['Weighted Cohen', pair] = kappa
+    return stats
+
+
+# Agreement statistics for every question, with bootstrap (percentile) confidence intervals over sites
+# Returns {question: {statistic: (estimate, low, high)}}, where Cohen statistics are keyed by (statistic, rater pair)
+def rater_agreements(raters, matrix, squash_agree=False, n_resamples=2000, confidence=0.95, batch_size=500, seed=0):
+    site_counts = SiteCounts(raters, matrix, squash_agree)
+    n_sites = matrix.shape[0]
+    estimates = agreement_batch(site_counts, np.ones((1, n_sites)))
+
+    # Each resample is a multinomial count of how many times each site is drawn
+    rng = np.random.default_rng(seed)
+    resamples = {statistic: [] for statistic in estimates}
+    for start in range(0, n_resamples, batch_size):
+        weights = rng.multinomial(n_sites, np.full(n_sites, 1.0 / n_sites), size=min(batch_size, n_resamples - start))
+        for statistic, values in agreement_batch(site_counts, weights.astype(float)).items():
+            resamples[statistic].append(values)
+
+    tail = (1 - confidence) / 2 * 100
+    results = {question: {} for question in questions}
+    for statistic, estimate in estimates.items():
+        low, high = np.nanpercentile(np.concatenate(resamples[statistic]), [tail, 100 - tail], axis=0)
+        for q, question in enumerate(questions):
+            results[question][statistic] = (float(estimate[0, q]), float(low[q]), float(high[q]))
+    return results
+
+
+if __name__ == "__main__":
+    _, raters, matrix = load_survey_table().matrix()
+    for squash_agree in [False, True]:
+        print("Squashed:" if squash_agree else "Unsquashed:")
+        for question, stats in rater_agreements(raters, matrix, squash_agree).items():
+            print(question)
+            for statistic, (estimate, low, high) in stats.items():
+                name = statistic if isinstance(statistic, str) else f"{statistic[0]} ({' & '.join(statistic[1])})"
+                print(f"    {name}: {estimate:.3f} [{low:.3f}, {high:.3f}]")
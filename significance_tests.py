@@ -1,14 +1,18 @@
-import csv
+import os
+import sys
+import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from math import sqrt
 import scipy.stats as stats
 import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib.patches import Patch
 from statsmodels.graphics.mosaicplot import mosaic
 
-from evaluate import sitelist_filename
+from site_list import load_site_table
 
 countries = ['UK', 'Ireland', 'Australia', 'New Zealand', 'USA', 'Canada']
 categories = ['Domestic Abuse', 'Rape/SA', 'LGBTQ+', 'BAME(R)', 'Sobriety', 'Smoking', 'Gambling',
@@ -16,6 +20,27 @@ categories = ['Domestic Abuse', 'Rape/SA', 'LGBTQ+', 'BAME(R)', 'Sobriety', 'Smo
               'Physical Health', 'Disability', 'Elderly', 'Past offenders', 'Victims', 'Police', 'Misc']
 collapsed_categories = ['Gendered Violence', 'Minorities', 'Addiction', 'Families', 'Healthcare', 'Crime', 'Misc']
 presence = ['Present', 'Absent']
+# Chunks of permutations run between checks of whether permutation_chi_squared can stop early
+chunks_per_round = 8
+platforms = ['Desktop', 'Mobile']
+mechanisms = ['Button', 'Shortcut']
+# Ways of grouping sites for contingency tables, and the groups of each
+groupings = {'country': countries, 'category': categories, 'collapsed category': collapsed_categories}
+
+# Category a site is counted under, either one of categories or (if collapsing) one of collapsed_categories
+def collapse_category(category, use_collapsed_categories=False):
+    if use_collapsed_categories:
+        if category in ['Domestic Abuse', 'Rape/SA']: category = 'Gendered Violence'
+        elif category in ['LGBTQ+', 'BAME(R)']: category = 'Minorities'
+        elif category in ['Sobriety', 'Smoking', 'Gambling']: category = 'Addiction'
+        elif category in ['Family Planning', 'Parenting', 'Children']: category = 'Families'
+        elif category in ['Sexual health', 'Mental Health', 'Physical Health', 'Disability']: category = 'Healthcare'
+        elif category in ['Past offenders', 'Victims', 'Police']: category = 'Crime'
+        else: category = 'Misc'
+    else:
+        if category not in categories:
+            category = 'Misc'
+    return category
 
 def count_mechanisms(platform, mechanism, use_collapsed_categories=False):
     selected_categories = collapsed_categories if use_collapsed_categories else categories
@@ -23,41 +48,33 @@ def count_mechanisms(platform, mechanism, use_collapsed_categories=False):
     country_counts = {(country,present): 0 for country in countries for present in presence}
     category_counts = {(category,present): 0 for category in selected_categories for present in presence}
     total = 0
-    with open(sitelist_filename, "r") as f:
-        reader = csv.DictReader(f)
-        for site in reader:
-            category = site['Category']
-            # Collapse categories
-            if use_collapsed_categories:
-                if category in ['Domestic Abuse', 'Rape/SA']: category = 'Gendered Violence'
-                elif category in ['LGBTQ+', 'BAME(R)']: category = 'Minorities'
-                elif category in ['Sobriety', 'Smoking', 'Gambling']: category = 'Addiction'
-                elif category in ['Family Planning', 'Parenting', 'Children']: category = 'Families'
-                elif category in ['Sexual health', 'Mental Health', 'Physical Health', 'Disability']: category = 'Healthcare'
-                elif category in ['Past offenders', 'Victims', 'Police']: category = 'Crime'
-                else: category = 'Misc'
-            else:
-                if category not in categories:
-                    category = 'Misc'
-
-            country = site['Region']
-            present = ((platform == 'Desktop' and mechanism == 'Button' and site['Desktop Exit Button?'] != '') or
-                (platform == 'Desktop' and mechanism == 'Shortcut' and site['Keyboard shortcut type'] != '') or
-                (platform == 'Mobile' and mechanism == 'Button' and site['Mobile Exit button?'] != '') or
-                (platform == 'Mobile' and mechanism == 'Shortcut' and site['Mobile shortcut?'] != ''))
-            country_counts[country,presence[1-present]]+=1
-            category_counts[category,presence[1-present]]+=1
-            if present:
-                total += 1
+    sites = load_site_table()
+    # Presence of each mechanism on each platform, by row
+    present_column = {
+        ('Desktop', 'Button'): sites.desktop_button,
+        ('Desktop', 'Shortcut'): sites.shortcut_type,
+        ('Mobile', 'Button'): sites.mobile_button,
+        ('Mobile', 'Shortcut'): sites.mobile_shortcut,
+    }.get((platform, mechanism))
+    # Category each category code is counted under
+    counted_categories = [collapse_category(category, use_collapsed_categories) for category in sites.categories]
+    for row in range(len(sites)):
+        category = counted_categories[sites.category_codes[row]]
+        country = sites.region(row)
+        present = present_column is not None and present_column[row] == 1
+        country_counts[country,presence[1-present]]+=1
+        category_counts[category,presence[1-present]]+=1
+        if present:
+            total += 1
 
     return country_counts, category_counts, total
 
 
-def chi_squared_tests(platform, mechanism, use_collapsed_categories=False):
+def chi_squared_tests(platform, mechanism, use_collapsed_categories=False, draw=True):
     selected_categories = collapsed_categories if use_collapsed_categories else categories
     country_counts, category_counts, total = count_mechanisms(platform, mechanism, use_collapsed_categories)
     residuals = {}
-    likelihood_mechanism = total / 2045.0
+    likelihood_mechanism = total / float(sum(country_counts.values()))
     chi2_country = 0
     for i, country in enumerate(countries):
         # Entry for presence in country
@@ -72,7 +89,8 @@ def chi_squared_tests(platform, mechanism, use_collapsed_categories=False):
         chi2_country += r_ij ** 2
     dof_country = len(countries) - 1
     p_country = 1 - stats.chi2.cdf(chi2_country, dof_country)
-    draw_mosaic(country_counts, residuals, platform, mechanism)
+    if draw:
+        draw_mosaic(country_counts, residuals, platform, mechanism)
 
     chi2_category = 0
     for j, category in enumerate(selected_categories):
@@ -88,32 +106,201 @@ def chi_squared_tests(platform, mechanism, use_collapsed_categories=False):
         chi2_category += r_ij ** 2
     dof_category = len(selected_categories) - 1
     p_category = 1 - stats.chi2.cdf(chi2_category, dof_category)
-    draw_mosaic(category_counts, residuals, platform, mechanism)
+    if draw:
+        draw_mosaic(category_counts, residuals, platform, mechanism)
 
     return chi2_country, dof_country, p_country, chi2_category, dof_category, p_category
 
-def draw_mosaic(counts, residuals, platform, mechanism):
-    # Set colour based on residuals
-    props = lambda k: {'color': 'red' if residuals[k] > 4 else
-                                'brown' if residuals[k] > 2 else
-                                'saddlebrown' if residuals[k] > 0.5 else
-                                'blue' if residuals[k] < -4 else
-                                'teal' if residuals[k] < -2 else
-                                'yellowgreen' if residuals[k] < -0.5 else
-                                'green' # -0.5 <= r <= 0.5
+# Contingency tables for every platform x mechanism, for each way of grouping sites (see groupings), in one pass
+# Returns the labels of each grouping's rows and an array of counts indexed [platform, mechanism, group, presence]
+def contingency_tables():
+    sites = load_site_table()
+    present = site_presence(sites)
+    tables = {}
+    for grouping, group_of_site in site_groups(sites).items():
+        labels = groupings[grouping]
+        # One-hot matrix of which group each site is in: shape (site, group)
+        one_hot = (group_of_site[:, None] == np.arange(len(labels))[None, :]).astype(float)
+        n_present = present @ one_hot
+        n_absent = one_hot.sum(axis=0) - n_present
+        tables[grouping] = labels, np.stack([n_present, n_absent], axis=-1)
+    return tables
+
+# Presence of every platform x mechanism for each site: shape (platform, mechanism, site)
+def site_presence(sites):
+    return np.array([[sites.desktop_button, sites.shortcut_type],
+                     [sites.mobile_button, sites.mobile_shortcut]], dtype=float)
+
+# Index of the group each site is in, for each grouping (-1 if in none of the groups)
+def site_groups(sites):
+    codes = {
+        'country': [countries.index(region) if region in countries else -1 for region in sites.regions],
+        'category': [categories.index(collapse_category(category)) for category in sites.categories],
+        'collapsed category': [collapsed_categories.index(collapse_category(category, True))
+                               for category in sites.categories],
     }
-    # Provide same colours with labels for the legend
-    legend_colours = [
-        Patch(color='red', label='residual > 4'),
-        Patch(color='brown', label='4 >= residual > 2'),
-        Patch(color='saddlebrown', label='2 >= residual > .5'),
-        Patch(color='green', label='0.5 >= residual >= -0.5'),
-        Patch(color='yellowgreen', label='-0.5 > residual >= -2'),
-        Patch(color='teal', label='-2 > residual >= -4'),
-        Patch(color='blue', label='-4 > residual'),
-    ]
-    # Generate plot for this figure
-    fig, ax = plt.subplots(figsize=(10,5))
+    row_codes = {'country': np.frombuffer(sites.region_codes, dtype=np.uint16),
+                 'category': np.frombuffer(sites.category_codes, dtype=np.uint16),
+                 'collapsed category': np.frombuffer(sites.category_codes, dtype=np.uint16)}
+    return {grouping: np.array(codes[grouping])[row_codes[grouping]] for grouping in groupings}
+
+# Chi squared test of independence for every table from contingency_tables, computed together
+# Returns, for each grouping, the counts, expected counts and Pearson residuals (indexed [platform, mechanism, group,
+# presence]) and the chi squared statistic, degrees of freedom and p value of each platform x mechanism
+def chi_squared_all():
+    results = {}
+    for grouping, (labels, counts) in contingency_tables().items():
+        group_totals = counts.sum(axis=-1, keepdims=True)
+        n_sites = group_totals.sum(axis=-2, keepdims=True)
+        presence_totals = counts.sum(axis=-2, keepdims=True)
+        expected = group_totals * presence_totals / n_sites
+        with np.errstate(divide='ignore', invalid='ignore'):
+            residuals = np.where(expected != 0, (counts - expected) / np.sqrt(expected), 0.0)
+        chi2 = (residuals ** 2).sum(axis=(-2, -1))
+        dof = len(labels) - 1
+        results[grouping] = {
+            'labels': labels, 'counts': counts, 'expected': expected, 'residuals': residuals,
+            'chi2': chi2, 'dof': dof, 'p': stats.chi2.sf(chi2, dof),
+        }
+    return results
+
+# Counts and residuals of one table from chi_squared_all as dictionaries by (group, presence), as used by draw_mosaic
+def table_dicts(result, platform, mechanism):
+    p, m = platforms.index(platform), mechanisms.index(mechanism)
+    counts, residuals = {}, {}
+    for g, label in enumerate(result['labels']):
+        for k, present in enumerate(presence):
+            counts[label, present] = int(result['counts'][p, m, g, k])
+            residuals[label, present] = float(result['residuals'][p, m, g, k])
+    return counts, residuals
+
+# Group index and presence (as 0/1) of each site in a platform x mechanism table, leaving out sites in no group
+def table_sites(platform, mechanism, grouping):
+    sites = load_site_table()
+    groups = site_groups(sites)[grouping]
+    present = site_presence(sites)[platforms.index(platform), mechanisms.index(mechanism)]
+    in_table = groups >= 0
+    return groups[in_table], present[in_table]
+
+# Chi squared statistic of a batch of tables, given the presence counts of each group: shape (batch, group)
+# The group sizes and number of sites present are either shared by every table (shapes (group,) and scalar, as for
+# permutations) or given per table (shapes (batch, group) and (batch,), as for bootstrap resamples)
+def batch_chi_squared(n_present, group_sizes, total_present):
+    n_sites = group_sizes.sum(axis=-1, keepdims=True)
+    expected_present = group_sizes * np.asarray(total_present)[..., None] / n_sites
+    expected_absent = group_sizes - expected_present
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2 = np.where(expected_present > 0, (n_present - expected_present) ** 2 / expected_present, 0.0) + \
+               np.where(expected_absent > 0, (n_present - expected_present) ** 2 / expected_absent, 0.0)
+    return chi2.sum(axis=-1)
+
+# Count how many of n_permutations random relabellings of presence give a chi squared statistic of at least observed
+# Permutations are done batch_size at a time, each batch as a single array operation
+def permutation_chunk(seed, groups, present, observed, n_permutations, batch_size):
+    rng = np.random.default_rng(seed)
+    one_hot = (groups[:, None] == np.arange(groups.max() + 1)[None, :]).astype(np.float32)
+    group_sizes = one_hot.sum(axis=0)
+    hits = 0
+    for start in range(0, n_permutations, batch_size):
+        batch = min(batch_size, n_permutations - start)
+        shuffled = rng.permuted(np.broadcast_to(present.astype(np.float32), (batch, len(present))), axis=1)
+        chi2 = batch_chi_squared(shuffled @ one_hot, group_sizes, present.sum())
+        # Small tolerance so that permutations equal to the observed table count as at least as extreme
+        hits += int(np.count_nonzero(chi2 >= observed - 1e-9))
+    return hits
+
+# Monte-Carlo permutation chi squared test of a platform x mechanism table, for tables with small expected counts
+# Permutations are split into chunks of chunk_size, each seeded from seed so results don't depend on the number of
+# processes. Stops once the confidence interval of the p value is narrower than tolerance (or after max_permutations)
+def permutation_chi_squared(platform, mechanism, grouping='category', max_permutations=1000000, tolerance=0.005,
+                            confidence=0.99, chunk_size=10000, batch_size=1000, seed=0, processes=None):
+    groups, present = table_sites(platform, mechanism, grouping)
+    group_sizes = np.bincount(groups, minlength=len(groupings[grouping])).astype(float)
+    observed = float(batch_chi_squared(np.bincount(groups, weights=present, minlength=len(group_sizes)),
+                                       group_sizes, present.sum()))
+    processes = processes or os.cpu_count()
+    seeds = np.random.SeedSequence(seed).spawn(-(-max_permutations // chunk_size))
+    hits, n = 0, 0
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        # Run a fixed number of chunks per round, so the stopping point is the same on any number of processes
+        for round_start in range(0, len(seeds), chunks_per_round):
+            round_seeds = seeds[round_start:round_start + chunks_per_round]
+            futures = [executor.submit(permutation_chunk, s, groups, present, observed, chunk_size, batch_size)
+                       for s in round_seeds]
+            hits += sum(future.result() for future in futures)
+            n += chunk_size * len(round_seeds)
+            p_ci = stats.binomtest(hits, n).proportion_ci(confidence)
+            if p_ci.high - p_ci.low < tolerance:
+                break
+    return {
+        'chi2': observed, 'dof': len(group_sizes) - 1,
+        # Include the observed table, so the p value is never 0
+        'p': (hits + 1) / (n + 1), 'p_ci': (p_ci.low, p_ci.high), 'n_permutations': n,
+    }
+
+# Presence rate of each group and Cramer's V of n_resamples bootstrap resamples of the sites
+# Every resample's (absent/present, group) table is counted in one bincount, by offsetting each site's table index by
+# its resample, giving an array of shape (resample, 2, group) whose chi squared statistics are found in one call
+def bootstrap_chunk(seed, groups, present, n_groups, n_resamples):
+    rng = np.random.default_rng(seed)
+    sample = rng.integers(0, len(groups), size=(n_resamples, len(groups)))
+    index = ((np.arange(n_resamples)[:, None] * 2 + present[sample].astype(int)) * n_groups + groups[sample]).ravel()
+    tables = np.bincount(index, minlength=n_resamples * 2 * n_groups).reshape(n_resamples, 2, n_groups)
+    n_present, group_sizes = tables[:, 1], tables.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = n_present / group_sizes
+    chi2 = batch_chi_squared(n_present, group_sizes, n_present.sum(axis=-1))
+    return rates, np.sqrt(chi2 / len(groups))
+
+# Bootstrap confidence intervals (percentile) for the presence rate in each group and for Cramer's V (the strength
+# of association between group and presence) of a platform x mechanism table
+def bootstrap_presence(platform, mechanism, grouping='category', n_resamples=10000, confidence=0.95,
+                       chunk_size=1000, seed=0, processes=None):
+    groups, present = table_sites(platform, mechanism, grouping)
+    labels = groupings[grouping]
+    processes = processes or os.cpu_count()
+    seeds = np.random.SeedSequence(seed).spawn(-(-n_resamples // chunk_size))
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(bootstrap_chunk, s, groups, present, len(labels),
+                                   min(chunk_size, n_resamples - i * chunk_size))
+                   for i, s in enumerate(seeds)]
+        chunks = [future.result() for future in futures]
+    rates = np.concatenate([chunk[0] for chunk in chunks])
+    cramers_v = np.concatenate([chunk[1] for chunk in chunks])
+    tail = (1 - confidence) / 2 * 100
+    group_sizes = np.bincount(groups, minlength=len(labels))
+    return {
+        'labels': labels,
+        'rates': np.bincount(groups, weights=present, minlength=len(labels)) / np.maximum(group_sizes, 1),
+        'rate_ci': np.nanpercentile(rates, [tail, 100 - tail], axis=0).T,
+        'cramers_v_ci': tuple(np.percentile(cramers_v, [tail, 100 - tail])),
+    }
+
+# Colour of a mosaic tile, based on its residual
+def residual_colour(residual):
+    return ('red' if residual > 4 else
+            'brown' if residual > 2 else
+            'saddlebrown' if residual > 0.5 else
+            'blue' if residual < -4 else
+            'teal' if residual < -2 else
+            'yellowgreen' if residual < -0.5 else
+            'green')  # -0.5 <= r <= 0.5
+
+# Provide same colours with labels for the legend
+legend_colours = [
+    Patch(color='red', label='residual > 4'),
+    Patch(color='brown', label='4 >= residual > 2'),
+    Patch(color='saddlebrown', label='2 >= residual > .5'),
+    Patch(color='green', label='0.5 >= residual >= -0.5'),
+    Patch(color='yellowgreen', label='-0.5 > residual >= -2'),
+    Patch(color='teal', label='-2 > residual >= -4'),
+    Patch(color='blue', label='-4 > residual'),
+]
+
+# Plot a mosaic of counts on ax, coloured by residuals
+def plot_mosaic(ax, counts, residuals, platform, mechanism):
+    # Set colour based on residuals
+    props = lambda k: {'color': residual_colour(residuals[k])}
     # Remove all labels
     labeliser = lambda k: '' #"\n".join(k) if abs(residuals[k])>4 else ''
     # Generate a mosaic plot based on counts with colours given by associated residuals
@@ -121,18 +308,84 @@ def draw_mosaic(counts, residuals, platform, mechanism):
            title='Presence of '+platform+' '+mechanism)
     # Fix x labels
     plt.setp(ax.get_xticklabels(), rotation=45, horizontalalignment='right')
+
+# Make a figure with a single axes and the residual legend, laid out for mosaics
+def make_mosaic_figure(fig):
+    ax = fig.add_subplot()
     # Add legend
     fig.legend(handles=legend_colours, loc=(0.725, 0.5))
     # Fix spacing
     fig.subplots_adjust(left=0.1, right=0.7, bottom=0.25)
+    return ax
+
+def draw_mosaic(counts, residuals, platform, mechanism):
+    # Generate plot for this figure
+    fig = plt.figure(figsize=(10,5))
+    ax = make_mosaic_figure(fig)
+    plot_mosaic(ax, counts, residuals, platform, mechanism)
     fig.show()
 
+# Render mosaics to files without displaying them, reusing one figure (and its legend) for all of them
+# Each job is (filename without extension, counts, residuals, platform, mechanism); files are written in each format
+def render_mosaic_files(jobs, formats=('png', 'svg')):
+    # Figure not managed by pyplot, so it is never shown and is freed as soon as rendering is done
+    fig = Figure(figsize=(10,5))
+    ax = make_mosaic_figure(fig)
+    filenames = []
+    try:
+        for name, counts, residuals, platform, mechanism in jobs:
+            plot_mosaic(ax, counts, residuals, platform, mechanism)
+            for fmt in formats:
+                fig.savefig(name + '.' + fmt)
+                filenames.append(name + '.' + fmt)
+            # Remove the twin axes mosaic adds for labels, and reset the main axes for the next plot
+            for extra_ax in fig.axes[1:]:
+                extra_ax.remove()
+            ax.clear()
+    finally:
+        fig.clear()
+    return filenames
+
+# Render the country and category mosaics for every platform and mechanism to files in output_dir
+# If processes > 1, the mosaics are split between that many worker processes
+def render_mosaics(output_dir='mosaics', formats=('png', 'svg'), processes=1):
+    os.makedirs(output_dir, exist_ok=True)
+    results = chi_squared_all()
+    jobs = []
+    for grouping, result in results.items():
+        for platform in platforms:
+            for mechanism in mechanisms:
+                name = f"{platform}_{mechanism}_{grouping.replace(' ', '_')}".lower()
+                jobs.append((os.path.join(output_dir, name), *table_dicts(result, platform, mechanism),
+                             platform, mechanism))
+    if processes <= 1:
+        return render_mosaic_files(jobs, formats)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(render_mosaic_files, jobs[i::processes], formats) for i in range(processes)]
+        return [filename for future in futures for filename in future.result()]
+
 if __name__ == '__main__':
-    print("Desktop button:", chi_squared_tests('Desktop', 'Button'))
-    #print(chi_squared_tests('Desktop', 'Shortcut'))
-    print("Mobile button:", chi_squared_tests('Mobile', 'Button'))
-    #print(chi_squared_tests('Mobile', 'Shortcut'))
-    print("Desktop button [combined]:", chi_squared_tests('Desktop', 'Button', True))
-    #print(chi_squared_tests('Desktop', 'Shortcut', True))
-    print("Mobile button [combined]:", chi_squared_tests('Mobile', 'Button', True))
-    #print(chi_squared_tests('Mobile', 'Shortcut', True))
\ No newline at end of file
+    if '--render' in sys.argv:
+        # Write all mosaics to files instead of showing them
+        output_dir = sys.argv[sys.argv.index('--render') + 1] if len(sys.argv) > sys.argv.index('--render') + 1 \
+            else 'mosaics'
+        start = time.perf_counter()
+        filenames = render_mosaics(output_dir, processes=os.cpu_count())
+        print(f"Rendered {len(filenames)} files to {output_dir} in {time.perf_counter() - start:.1f}s")
+        sys.exit(0)
+    results = chi_squared_all()
+    for grouping in ['category', 'collapsed category']:
+        for platform, mechanism in [('Desktop', 'Button'), ('Mobile', 'Button')]:  # Too few shortcuts to test
+            p, m = platforms.index(platform), mechanisms.index(mechanism)
+            country, category = results['country'], results[grouping]
+            print(f"{platform} {mechanism.lower()}{' [combined]' if grouping == 'collapsed category' else ''}:",
+                  (float(country['chi2'][p, m]), country['dof'], float(country['p'][p, m]),
+                   float(category['chi2'][p, m]), category['dof'], float(category['p'][p, m])))
+            draw_mosaic(*table_dicts(country, platform, mechanism), platform, mechanism)
+            draw_mosaic(*table_dicts(category, platform, mechanism), platform, mechanism)
+    if '--permutation' in sys.argv:
+        # Shortcut tables have tiny expected counts, so use Monte-Carlo p values rather than the chi squared distribution
+        for grouping in ['country', 'category', 'collapsed category']:
+            for platform in platforms:
+                print(f"{platform} shortcut [{grouping}, permutation]:",
+                      permutation_chi_squared(platform, 'Shortcut', grouping))
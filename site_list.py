@@ -0,0 +1,261 @@
+# Quick exit button site list
+#
+# Lightweight definitions of the sites to evaluate, kept separate from the browser harness so that the analysis
+# scripts can read the site list without importing selenium or setting up a chrome driver
+
+import csv
+import hashlib
+import io
+import os
+import pickle
+import random
+from array import array
+from collections import OrderedDict
+from itertools import islice
+
+# Globals
+sitelist_filename = "./exit_button_sites.csv"
+# Parsed site lists by filename (see load_site_table)
+site_tables = {}
+# Store websites to evaluate (will be populated on load, as SiteRegistry-s; see below)
+desktop_site_list = None
+mobile_site_list = None
+
+
+# Class for sites that will be evaluated
+class Site:
+    __slots__ = ('url', 'mobile_site', 'shortcut', '_has_explainer', 'safe_browsing_url', '_has_button')
+
+    def __init__(self, url, mobile_site=False, shortcut=None,
+                 has_button=True, has_explainer=False, safe_browsing_url=None):
+        self.url = url
+        self.mobile_site = mobile_site
+        self.shortcut = shortcut
+        self._has_explainer = has_explainer
+        self.safe_browsing_url = safe_browsing_url
+        self._has_button = has_button
+
+    # Print string of
+    def __str__(self):
+        return f'[{"mobile" if self.mobile_site else "desktop"}]{self.url} | ' \
+               f'contains [{"button," if self.has_button() else ""}{"shortcut," if self.has_shortcut() else ""}' \
+               f'{"explainer," if self.has_explainer() else ""}{"safety" if self.has_safe_browsing_page() else ""}] | '\
+               f'shortcut = {self.shortcut if self.has_shortcut() else "N/A"} | ' \
+               f'safe browsing page = {self.safe_browsing_url if self.has_safe_browsing_page() else "N/A"} '
+
+    def __repr__(self):
+        return self.__str__()
+
+    # Sites are identified by their url and whether they are the mobile site
+    def key(self):
+        return self.url, self.mobile_site
+
+    def __eq__(self, other):
+        if not isinstance(other, Site):
+            return NotImplemented
+        return self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def has_button(self):
+        return self._has_button
+
+    def has_shortcut(self):
+        return self.shortcut is not None
+
+    def has_explainer(self):
+        return self._has_explainer
+
+    def has_safe_browsing_page(self):
+        return self.safe_browsing_url is not None
+
+
+# Sites to evaluate in order, keyed by (url, mobile_site), so that finding and removing sites doesn't scan the list
+class SiteRegistry:
+    def __init__(self, sites=()):
+        self._sites = OrderedDict()
+        for site in sites:
+            self.add(site)
+
+    def __len__(self):
+        return len(self._sites)
+
+    # Iterates over a snapshot, so sites can be removed while iterating
+    def __iter__(self):
+        return iter(list(self._sites.values()))
+
+    # Accepts a Site or a (url, mobile_site) key
+    def __contains__(self, site):
+        return (site.key() if isinstance(site, Site) else site) in self._sites
+
+    def __repr__(self):
+        return f'SiteRegistry({list(self._sites.values())!r})'
+
+    def add(self, site):
+        self._sites[site.key()] = site
+
+    # Remove a Site or (url, mobile_site) key if present, returning whether it was
+    def discard(self, site):
+        return self._sites.pop(site.key() if isinstance(site, Site) else site, None) is not None
+
+    # First n sites still to evaluate
+    def head(self, n):
+        return list(islice(self._sites.values(), n))
+
+    def pop_first(self):
+        return self._sites.popitem(last=False)[1]
+
+    def shuffle(self):
+        sites = list(self._sites.values())
+        random.shuffle(sites)
+        self._sites = OrderedDict((site.key(), site) for site in sites)
+
+    def clear(self):
+        self._sites.clear()
+
+
+desktop_site_list = SiteRegistry()
+mobile_site_list = SiteRegistry()
+
+
+# Site list parsed into columns, one entry per row of the site list
+# Category and region names are stored once, with a small integer code per row; yes/no columns are stored as 0/1 arrays
+class SiteTable:
+    def __init__(self, mtime=None, digest=None):
+        # Modification time and hash of the file this was parsed from, used to tell if the cache is stale
+        self.mtime = mtime
+        self.digest = digest
+        self.urls = []
+        self.categories = []
+        self.category_codes = array('H')
+        self.regions = []
+        self.region_codes = array('H')
+        self.desktop_button = array('b')
+        self.mobile_button = array('b')
+        self.shortcut_type = array('b')
+        self.mobile_shortcut = array('b')
+        self.explainer = array('b')
+        # Sparse columns (most rows are blank), by row
+        self.desktop_shortcut_keys = {}
+        self.mobile_shortcut_keys = {}
+        self.safe_browsing_urls = {}
+
+    def __len__(self):
+        return len(self.urls)
+
+    def category(self, row):
+        return self.categories[self.category_codes[row]]
+
+    def region(self, row):
+        return self.regions[self.region_codes[row]]
+
+
+# Parse the text of the site list CSV into a SiteTable
+def parse_site_table(text, mtime=None, digest=None):
+    table = SiteTable(mtime, digest)
+    category_codes, region_codes = {}, {}
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader)
+    column = {name: i for i, name in enumerate(header)}
+    url_col, category_col, region_col = column['URL'], column['Category'], column['Region']
+    desktop_button_col, mobile_button_col = column['Desktop Exit Button?'], column['Mobile Exit button?']
+    shortcut_type_col, shortcut_keys_col = column['Keyboard shortcut type'], column['Shortcut keys']
+    mobile_shortcut_col, explainer_col = column['Mobile shortcut?'], column['explainer text?']
+    safe_browsing_col = column['Safe browsing url']
+
+    for row, site in enumerate(reader):
+        url = site[url_col]
+        table.urls.append(url)
+        table.category_codes.append(category_codes.setdefault(site[category_col], len(category_codes)))
+        table.region_codes.append(region_codes.setdefault(site[region_col], len(region_codes)))
+        table.desktop_button.append(site[desktop_button_col] != "")
+        table.mobile_button.append(site[mobile_button_col] != "")
+        table.shortcut_type.append(site[shortcut_type_col] != "")
+        table.mobile_shortcut.append(site[mobile_shortcut_col] != "")
+        table.explainer.append(site[explainer_col] != "")
+        if site[shortcut_keys_col] != "":
+            table.desktop_shortcut_keys[row] = site[shortcut_keys_col]
+        if site[mobile_shortcut_col] != "":
+            table.mobile_shortcut_keys[row] = site[mobile_shortcut_col]
+        if site[safe_browsing_col] != "":
+            table.safe_browsing_urls[row] = site[safe_browsing_col]
+    table.categories = list(category_codes)
+    table.regions = list(region_codes)
+    return table
+
+
+# Load the site list as a SiteTable, parsing it only if it changed since it was last loaded
+# Parsed tables are cached in memory and in a sidecar file next to the site list, keyed on the file's mtime and hash
+def load_site_table(filename=None):
+    filename = filename or sitelist_filename
+    mtime = os.stat(filename).st_mtime_ns
+    table = site_tables.get(filename)
+    if table is not None and table.mtime == mtime:
+        return table
+
+    cache_filename = filename + ".cache"
+    if table is None and os.path.exists(cache_filename):
+        try:
+            with open(cache_filename, "rb") as f:
+                table = pickle.load(f)
+        except Exception:
+            # Unreadable (e.g. from an older version); parse again below
+            table = None
+    if table is not None and table.mtime == mtime:
+        site_tables[filename] = table
+        return table
+
+    with open(filename, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if table is None or table.digest != digest:
+        table = parse_site_table(data.decode("utf-8"), mtime, digest)
+    # else: file touched but unchanged, so only the mtime needs updating
+    table.mtime = mtime
+    site_tables[filename] = table
+    try:
+        with open(cache_filename + ".tmp", "wb") as f:
+            pickle.dump(table, f)
+        os.replace(cache_filename + ".tmp", cache_filename)
+    except OSError:
+        # Cache is only an optimisation (e.g. read-only checkout)
+        pass
+    return table
+
+
+# Parse site list into arrays of Site-s
+def parse_site_list():
+    global desktop_site_list, mobile_site_list
+    table = load_site_table()
+
+    for row, url in enumerate(table.urls):
+        if url == "":
+            # blank or analytics row
+            continue
+        has_desktop_button = table.desktop_button[row] == 1
+        has_mobile_button = table.mobile_button[row] == 1
+        desktop_shortcut = table.desktop_shortcut_keys.get(row)
+        mobile_shortcut = table.mobile_shortcut_keys.get(row)
+        explainer_text = table.explainer[row] == 1
+        safe_browsing_url = table.safe_browsing_urls.get(row)
+
+        # Add to relevant list(s)
+        if has_desktop_button or desktop_shortcut is not None:
+            desktop_site_list.add(Site(
+                url,
+                mobile_site=False,
+                has_button=has_desktop_button,
+                shortcut=desktop_shortcut,
+                has_explainer=explainer_text,
+                safe_browsing_url=safe_browsing_url,
+            ))
+        if has_mobile_button or mobile_shortcut is not None:
+            mobile_site_list.add(Site(
+                url,
+                mobile_site=True,
+                has_button=has_mobile_button,
+                shortcut=mobile_shortcut,
+                has_explainer=explainer_text,
+                safe_browsing_url=safe_browsing_url,
+            ))
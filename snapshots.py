@@ -0,0 +1,175 @@
+# Offline page snapshots
+#
+# Pages are saved as MHTML (with the Chrome DevTools Page.captureSnapshot command), keyed by url and platform, so that
+# later runs can load them from disk instead of fetching the live site: page loads are then fast, need no network, and
+# stay the same between runs. Snapshots keep a page's HTML, styles and images but not its scripts, so they suit
+# annotation, crawling and page load benchmarks, but not the timing tests (where the exit button needs to work)
+#
+# The least recently used snapshots are deleted once the store is larger than its size budget. Several processes (and
+# threads) may share a store: changes to the index are made while holding a lock on the store's lock file, after reading
+# the index afresh, so no process's snapshots are forgotten. Unix only (the lock file is locked with flock)
+import fcntl
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import time
+
+# Default location and size budget of the snapshot store
+snapshot_dir = "./snapshots"
+snapshot_budget = 2 * 1024**3
+# Seconds between saving when snapshots were last used to the index
+save_uses_every = 60
+
+
+def remove_if_exists(filename):
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        # Already removed by another process
+        pass
+
+
+class SnapshotStore:
+    def __init__(self, directory=snapshot_dir, budget=snapshot_budget):
+        self.directory = directory
+        self.budget = budget
+        self.index_filename = os.path.join(directory, "index.json")
+        self.lock_filename = os.path.join(directory, "index.lock")
+        # Snapshot details by key: url, platform, size in bytes, and when it was captured and last used
+        self.index = {}
+        # When snapshots were opened since the index was last saved, by key
+        self.uses = {}
+        self.uses_saved = time.time()
+        # Browsers in different threads (e.g. auto_annotate.py) share a store
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.index = self.read_index()
+
+    @staticmethod
+    def key(url, mobile):
+        return hashlib.sha256(f'{"Mobile" if mobile else "Desktop"} {url}'.encode()).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.directory, key + ".mhtml")
+
+    # Snapshot files in the directory and their sizes, including any missing from the index (e.g. left by a crash)
+    def files(self):
+        return {entry.name[:-len(".mhtml")]: entry.stat().st_size for entry in os.scandir(self.directory)
+                if entry.name.endswith(".mhtml")}
+
+    def size(self):
+        return sum(self.files().values())
+
+    # Snapshots are checked for on disk, as another process may have saved or evicted one since the index was read
+    def __contains__(self, page):
+        url, mobile = page
+        return os.path.exists(self.filename(self.key(url, mobile)))
+
+    # Lock the store against other processes (shared for loading a snapshot, exclusive for changing the store)
+    # The lock file is opened afresh each time, so threads of one process also lock each other out
+    def lock_store(self, operation):
+        fd = os.open(self.lock_filename, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, operation)
+        return fd
+
+    def unlock_store(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def read_index(self):
+        if not os.path.exists(self.index_filename):
+            return {}
+        try:
+            with open(self.index_filename, "r") as f:
+                return json.load(f)
+        except ValueError:
+            # Corrupt index; snapshots will be captured again
+            return {}
+
+    # Read the index afresh (with the store locked), adding when snapshots were used by this process
+    def reload_index(self):
+        self.index = self.read_index()
+        for key, used in self.uses.items():
+            if key in self.index:
+                self.index[key]["last_used"] = max(self.index[key]["last_used"], used)
+        self.uses = {}
+
+    # Save the index (with the store locked)
+    def save_index(self):
+        with open(self.index_filename + ".tmp", "w") as f:
+            json.dump(self.index, f)
+        os.replace(self.index_filename + ".tmp", self.index_filename)
+        self.uses_saved = time.time()
+
+    # Save when snapshots were last used, so they aren't evicted before less recently used ones
+    def save_uses(self):
+        fd = self.lock_store(fcntl.LOCK_EX)
+        try:
+            with self.lock:
+                self.reload_index()
+                self.save_index()
+        finally:
+            self.unlock_store(fd)
+
+    # Load a page's snapshot in a browser, returning False (and loading nothing) if there isn't one
+    def open(self, driver, url, mobile):
+        key = self.key(url, mobile)
+        # Held while loading, so the snapshot isn't evicted part way through
+        fd = self.lock_store(fcntl.LOCK_SH)
+        try:
+            if not os.path.exists(self.filename(key)):
+                return False
+            with self.lock:
+                self.uses[key] = time.time()
+                uses_due = time.time() - self.uses_saved > save_uses_every
+            driver.get(pathlib.Path(self.filename(key)).resolve().as_uri())
+        finally:
+            self.unlock_store(fd)
+        # The index is only saved every so often, rather than on every page opened
+        if uses_due:
+            self.save_uses()
+        return True
+
+    # Save the page currently loaded in a browser as the snapshot of url
+    def record(self, driver, url, mobile):
+        data = driver.execute_cdp_cmd("Page.captureSnapshot", {"format": "mhtml"})["data"].encode()
+        key = self.key(url, mobile)
+        fd = self.lock_store(fcntl.LOCK_EX)
+        try:
+            with self.lock:
+                with open(self.filename(key) + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(self.filename(key) + ".tmp", self.filename(key))
+                self.reload_index()
+                now = time.time()
+                self.index[key] = {"url": url, "platform": "Mobile" if mobile else "Desktop", "size": len(data),
+                                   "captured": now, "last_used": now}
+                self.evict()
+                self.save_index()
+        finally:
+            self.unlock_store(fd)
+
+    # Delete least recently used snapshots until the store is within budget (with the store locked)
+    # Every snapshot file in the directory counts towards the budget; any missing from the index are deleted first
+    def evict(self):
+        files = self.files()
+        # Forget snapshots whose files have gone
+        self.index = {key: entry for key, entry in self.index.items() if key in files}
+        total = sum(files.values())
+        for key in sorted(files, key=lambda k: (k in self.index, self.index[k]["last_used"] if k in self.index else 0)):
+            if total <= self.budget:
+                break
+            total -= files[key]
+            self.index.pop(key, None)
+            remove_if_exists(self.filename(key))
+
+    # Load a page from its snapshot, or from the live site (saving a snapshot) if there isn't one yet
+    # Returns whether the snapshot was used
+    def load(self, driver, url, mobile):
+        if self.open(driver, url, mobile):
+            return True
+        driver.get(url)
+        self.record(driver, url, mobile)
+        return False